@@ -0,0 +1,209 @@
+"""
+Benchmarks of sever.py on simulated hardware
+
+Runs the server code against simulator.SimulatedBus and SimulatedGPIO, so no
+Raspberry Pi is needed, and reports:
+
+- I2C transactions per reading of each sensor path
+- latency (p50 / p99) of `/?q=all`
+- requests per second of `/?q=all` under concurrent clients
+
+    python benchmark.py --latency 0.0002 --clients 8 --requests 2000
+    python benchmark.py --keep-alive
+    python benchmark.py --json > results.json
+
+"""
+
+import argparse
+import json
+import time
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer
+from threading import Thread
+
+import simulator
+import sever
+
+
+class QuietHandler(sever.SensorHTTPServer):
+    # Request handler without the per-request log line (and without a WebUI)
+    def log_message(self, format, *args):
+        pass
+
+
+def make_hardware(latency):
+    # Simulated bus and GPIO with the sensors the server expects
+    gpio = simulator.SimulatedGPIO()
+    sever.set_gpio_backend(gpio)
+    gpio.setmode(gpio.BOARD)
+    for pin in (sever.PIN35, sever.PIN36, sever.PIN29):
+        gpio.setup(pin, gpio.IN)
+    bus = simulator.SimulatedBus(latency=latency)
+    return bus, sever.I2CBus(smbus=bus)
+
+
+def count_transactions(bus, action, repeat=1):
+    # Average number of I2C transactions of one call to action()
+    before = bus.total()
+    results = [action() for _ in range(repeat)]
+    return (bus.total() - before) / repeat, results
+
+
+def measure_transactions(latency):
+    # Transactions per reading of the command-style, continuous and FIFO paths
+    bus, i2c = make_hardware(latency)
+    results = {}
+    dps = sever.DPS(i2c)
+    results['dps_read_temperature'], _ = count_transactions(bus, dps.read_temperature, 10)
+    results['dps_read_pressure'], _ = count_transactions(bus, dps.read_pressure, 10)
+    results['dps_read_snapshot'], _ = count_transactions(bus, dps.read_snapshot, 10)
+
+    co2 = sever.PA_CO2(bus=i2c)
+    co2.measure_co2()  # Programs idle mode and the pressure compensation once
+    results['co2_single_shot'], _ = count_transactions(bus, co2.measure_co2)
+    co2.start_continuous_mode()
+    co2_model = bus.devices[co2.device_address]
+    co2_model.ready_time = time.monotonic()  # Result due now
+    results['co2_continuous_new'], _ = count_transactions(bus, co2.read_new_ppm)
+    results['co2_continuous_idle'], _ = count_transactions(bus, co2.read_new_ppm)
+
+    sampler = sever.SensorSampler(dps, co2)
+    results['sampler_sample_dps'], _ = count_transactions(bus, sampler.sample_dps, 10)
+
+    dps.start_background_mode(pressure_rate=64)
+    dps.read_fifo()
+    time.sleep(0.25)  # About 16 results
+    count, samples = count_transactions(bus, dps.read_fifo)
+    results['fifo_per_sample'] = count / max(1, len(samples[0]))
+    dps.stop_background_mode()
+    return results
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def get(address, path, connection=None):
+    # One request, on connection when given (keep-alive) or on a new connection
+    if connection is not None:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        response.read()
+        return response.status
+    connection = HTTPConnection(*address)
+    try:
+        return get(address, path, connection)
+    finally:
+        connection.close()
+
+
+def start_server(latency):
+    # Sampler and threaded HTTP server on a free port, backed by simulated hardware
+    bus, i2c = make_hardware(latency)
+    co2 = sever.PA_CO2(bus=i2c, period=5000)
+    bus.devices[co2.device_address].time_scale = 0.01  # 50 ms between CO2 results
+    co2.start_continuous_mode()
+    sampler = sever.SensorSampler(sever.DPS(i2c), co2, interval=0.01, co2_interval=0.01)
+    history = sever.HistoryBuffer(1000)
+    sampler.add_listener(history.append)
+    stats = sever.RollingStats()
+    sampler.add_listener(stats.append, channels=True)
+    QuietHandler.set_sampler(sampler)
+    QuietHandler.set_history(history)
+    QuietHandler.set_stats(stats)
+    sampler.start()
+    sampler.latest(5)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), QuietHandler)
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return sampler, server
+
+
+def measure_latency(address, path, requests, keep_alive=False):
+    # Sequential requests, returns the latencies in milliseconds
+    connection = HTTPConnection(*address) if keep_alive else None
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        get(address, path, connection)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {'requests': requests,
+            'p50_ms': percentile(latencies, 0.50),
+            'p99_ms': percentile(latencies, 0.99),
+            'max_ms': max(latencies)}
+
+
+def measure_throughput(address, path, clients, duration, keep_alive=False):
+    # clients threads sending requests back to back for duration seconds
+    counts = [0] * clients
+    errors = [0] * clients
+    deadline = time.perf_counter() + duration
+
+    def client(n):
+        connection = HTTPConnection(*address) if keep_alive else None
+        while time.perf_counter() < deadline:
+            try:
+                if get(address, path, connection) == 200:
+                    counts[n] += 1
+                else:
+                    errors[n] += 1
+            except OSError:
+                errors[n] += 1
+                if connection is not None:
+                    connection.close()  # Reconnects on the next request
+
+    start = time.perf_counter()
+    threads = [Thread(target=client, args=(n,)) for n in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {'clients': clients,
+            'requests': sum(counts),
+            'errors': sum(errors),
+            'requests_per_s': sum(counts) / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sever.py on simulated hardware")
+    parser.add_argument('--latency', type=float, default=0.0002,
+                        help="seconds per simulated I2C transaction (default 0.0002, about 100 kHz)")
+    parser.add_argument('--clients', type=int, default=8, help="concurrent HTTP clients (default 8)")
+    parser.add_argument('--requests', type=int, default=1000, help="sequential requests for the latency run (default 1000)")
+    parser.add_argument('--duration', type=float, default=5.0, help="seconds of the throughput run (default 5)")
+    parser.add_argument('--path', default='/?q=all', help="request path (default /?q=all)")
+    parser.add_argument('--keep-alive', action='store_true', help="reuse one connection per client")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = {'latency_s': args.latency, 'transactions': measure_transactions(args.latency)}
+    sampler, server = start_server(args.latency)
+    try:
+        results['http_latency'] = measure_latency(server.server_address, args.path, args.requests,
+                                                  args.keep_alive)
+        results['http_throughput'] = measure_throughput(server.server_address, args.path,
+                                                        args.clients, args.duration, args.keep_alive)
+    finally:
+        server.shutdown()
+        sampler.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"I2C transactions per reading ({args.latency * 1e6:.0f} us each):")
+    for name, count in results['transactions'].items():
+        print(f"  {name:24} {count:6.2f}")
+    latency = results['http_latency']
+    mode = "one connection per client" if args.keep_alive else "a connection per request"
+    print(f"GET {args.path} latency over {latency['requests']} requests ({mode}):")
+    print(f"  p50 {latency['p50_ms']:.2f} ms, p99 {latency['p99_ms']:.2f} ms, max {latency['max_ms']:.2f} ms")
+    throughput = results['http_throughput']
+    print(f"GET {args.path} with {throughput['clients']} clients:")
+    print(f"  {throughput['requests_per_s']:.0f} requests/s, {throughput['errors']} errors")
+
+
+if __name__ == "__main__":
+    main()
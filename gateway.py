@@ -0,0 +1,441 @@
+"""
+Fleet gateway for infineon optimus boards
+
+Polls the sever.py servers of many boards concurrently and serves their latest
+samples and their history merged on one port, tagged by board ID:
+
+- `/?q=all` the latest sample of every board, plus the boards that failed to answer
+- `/?q=history` the samples fetched from every board (`limit=N` for the newest)
+- `/?q=metrics` sweep and poll durations in the Prometheus text format
+
+`board=lab,hall` selects boards. Boards are given as `id=url` (or just the url):
+
+    python gateway.py lab=http://10.0.0.11:8080 hall=http://10.0.0.12:8080
+    python gateway.py --boards boards.txt --interval 5 --timeout 3 --port 8090
+    python gateway.py --once lab=http://10.0.0.11:8080 hall=http://10.0.0.12:8080
+
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import random
+import time
+from http.server import ThreadingHTTPServer
+from threading import Thread
+from urllib.parse import urlparse
+
+import sever
+
+GATEWAY_PORT = 8090
+POLL_INTERVAL = 5.0  # Seconds between sweeps over all boards
+POLL_TIMEOUT = 3.0  # Seconds a board has to answer before the poll counts as failed
+POLL_JITTER = 0.2  # Each board is polled up to this fraction of POLL_INTERVAL into a sweep
+GATEWAY_HISTORY = 3600  # Samples kept per board for ?q=history
+
+
+async def read_response(reader):
+    # Read one HTTP/1.1 response, returns the status, the decoded body and whether
+    # the connection can be used for the next request
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed by the board")
+    version, status = status_line.split(None, 2)[:2]
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    reusable = version == b'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        parts = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                while await reader.readline() not in (b'\r\n', b'\n', b''):
+                    pass  # Trailer fields
+                break
+            parts.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        body = b''.join(parts)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body = await reader.read()  # The body ends when the connection does
+        reusable = False
+    if headers.get('content-encoding') == 'gzip':
+        body = gzip.decompress(body)
+    return int(status), body, reusable
+
+
+class Board:
+    # One polled board: a kept-alive connection, the cursor of its ?q=history and
+    # a HistoryBuffer of the samples fetched so far. Every poll asks only for the
+    # samples after the cursor, so a poll costs one small response.
+    def __init__(self, board_id, url, timeout=POLL_TIMEOUT, capacity=GATEWAY_HISTORY):
+        parsed = urlparse(url if '://' in url else 'http://' + url)
+        self.id = board_id or parsed.netloc
+        self.url = url
+        self.host = parsed.hostname
+        self.ssl = parsed.scheme == 'https'
+        self.port = parsed.port or (443 if self.ssl else 80)
+        self.path = parsed.path.rstrip('/') + '/'
+        self.timeout = timeout
+        self.connection = None  # (reader, writer) kept alive between polls
+        self.history = sever.HistoryBuffer(capacity)
+        self.latest = None  # Newest Snapshot, None until the first sample
+        self.cursor = None  # seq of the newest sample, for ?q=history&since=
+        self.error = None  # Why the last poll failed, None when it succeeded
+        self.legacy = False  # The board has no seq in ?q=history, its ?q=all is polled instead
+        # Counters for ?q=metrics
+        self.polls = 0
+        self.failures = 0
+        self.poll_seconds = sever.Histogram()
+
+    async def fetch(self, query):
+        # GET /?<query> on the kept-alive connection, returns (status, body). A kept-alive
+        # connection the board has closed in the meantime is retried once on a new one.
+        request = ('GET %s?%s HTTP/1.1\r\nHost: %s:%d\r\nAccept-Encoding: gzip\r\n\r\n'
+                   % (self.path, query, self.host, self.port)).encode('latin-1')
+        for attempt in range(2):
+            reused = self.connection is not None
+            if not reused:
+                self.connection = await asyncio.open_connection(self.host, self.port, ssl=self.ssl or None)
+            reader, writer = self.connection
+            try:
+                writer.write(request)
+                status, body, reusable = await read_response(reader)
+            except BaseException as e:  # Also a timeout cancelling the poll mid-response
+                self.close()
+                if reused and attempt == 0 and isinstance(e, (ConnectionError, EOFError)):
+                    continue
+                raise
+            if not reusable:
+                self.close()
+            return status, body
+
+    def close(self):
+        # Drop the kept-alive connection
+        if self.connection is not None:
+            self.connection[1].close()
+            self.connection = None
+
+    async def poll(self, delay=0.0):
+        # Fetch the samples since the cursor after delay seconds, returns True when
+        # the merged responses change (new samples, the board failing or recovering)
+        await asyncio.sleep(delay)
+        start = time.perf_counter()
+        self.polls += 1
+        error = None
+        try:
+            changed = await asyncio.wait_for(self.request(), self.timeout)
+        except asyncio.TimeoutError:
+            error = "No answer within %g s" % self.timeout
+        except (OSError, EOFError, ValueError, KeyError, TypeError) as e:
+            error = str(e) or type(e).__name__
+        self.poll_seconds.observe(time.perf_counter() - start)
+        if error:
+            self.failures += 1
+            if error != self.error:
+                sever.log(f"Gateway: board {self.id} ({self.url}) failed: {error}")
+            changed = error != self.error
+        elif self.error:
+            sever.log(f"Gateway: board {self.id} ({self.url}) answers again")
+            changed = True
+        self.error = error
+        return changed
+
+    async def request(self):
+        # Fetch and store the samples since the cursor, returns True when there were any
+        if not self.legacy:
+            query = 'q=history&limit=%d' % self.history.capacity
+            if self.cursor is not None:
+                query += '&since=%d' % self.cursor
+            data = await self.fetch_json(query)
+            if isinstance(data, dict) and 'seq' in data:
+                return self.store(data)
+            # A board running an older sever.py, without sequence numbers
+            sever.log(f"Gateway: board {self.id} has no ?q=history cursor, polling its ?q=all")
+            self.legacy = True
+        return self.store_sample(await self.fetch_json('q=all'))
+
+    async def fetch_json(self, query):
+        status, body = await self.fetch(query)
+        if status != 200:
+            raise ValueError("HTTP %d" % status)
+        return json.loads(body)
+
+    def store(self, data):
+        # Append the samples of a ?q=history answer, returns True when there were any.
+        # The samples are consecutive and end at data['seq'].
+        seq = data['seq']
+        if self.cursor is not None and seq < self.cursor:
+            # The board restarted and counts from 1 again
+            sever.log(f"Gateway: board {self.id} restarted, its history starts over")
+            self.history = sever.HistoryBuffer(self.history.capacity)
+        names = [name for name, typecode in sever.HistoryBuffer.COLUMNS]
+        rows = list(zip(*[data[sever.json_name(name)] for name in names]))
+        for i, row in enumerate(rows):
+            values = dict(zip(names, row))
+            date_time = values['timestamp']
+            values['timestamp'] = sever.parse_time(date_time)
+            self.latest = sever.Snapshot(date_time=date_time, seq=seq - len(rows) + 1 + i, **values)
+            self.history.append(self.latest)
+        self.cursor = seq
+        return len(rows) > 0
+
+    def store_sample(self, data):
+        # Append the ?q=all answer of a board without sequence numbers, one sample
+        # per poll, numbered by the gateway
+        names = [name for name in sever.Snapshot._fields if name not in ('date_time', 'timestamp', 'seq')]
+        date_time = data['date_time']
+        self.latest = sever.Snapshot(date_time=date_time, timestamp=sever.parse_time(date_time),
+                                     seq=self.history.last_seq + 1, **{name: data.get(name) for name in names})
+        self.history.append(self.latest)
+        self.cursor = self.latest.seq
+        return True
+
+
+class Gateway:
+    # Polls all boards on one asyncio event loop in a background thread. A sweep
+    # starts the polls of all boards at once, each after a random delay of up to
+    # jitter * interval so the boards are not all asked at the same instant, and
+    # takes as long as the slowest board (at most timeout + that delay), not the
+    # sum of all boards. version counts the sweeps that changed the responses.
+    def __init__(self, boards, interval=POLL_INTERVAL, jitter=POLL_JITTER):
+        self.boards = boards
+        self.interval = interval
+        self.jitter = jitter
+        self.version = 0
+        self.last_sweep = None  # Seconds of the last sweep
+        self.sweep_seconds = sever.Histogram()
+        self.loop = None
+        self.task = None
+        self.thread = None
+
+    def board(self, board_id):
+        for board in self.boards:
+            if board.id == board_id:
+                return board
+        return None
+
+    async def sweep(self, spread=0.0):
+        # Poll every board once, concurrently
+        start = time.perf_counter()
+        changed = await asyncio.gather(*(board.poll(random.uniform(0, spread)) for board in self.boards))
+        self.last_sweep = time.perf_counter() - start
+        self.sweep_seconds.observe(self.last_sweep)
+        if any(changed):
+            self.version += 1
+
+    async def run(self):
+        # Sweep every interval until stop(), the first sweep without delays
+        spread = 0.0
+        try:
+            while True:
+                start = time.monotonic()
+                await self.sweep(spread)
+                spread = self.jitter * self.interval
+                await asyncio.sleep(max(start + self.interval - time.monotonic(), 0))
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.close()
+
+    def start(self):
+        # Run the sweeps on a new event loop in a background thread
+        self.loop = asyncio.new_event_loop()
+        self.task = self.loop.create_task(self.run())
+        self.thread = Thread(target=self.loop.run_until_complete, args=(self.task,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.task.cancel)
+        self.thread.join()
+        self.loop.close()
+
+    def close(self):
+        for board in self.boards:
+            board.close()
+
+    def latest(self, boards):
+        # JSON-ready dict of the newest sample of each board, as returned by ?q=all,
+        # and the error of each board whose last poll failed
+        return {'boards': {board.id: sever.snapshot_data(board.latest) for board in boards if board.latest},
+                'errors': {board.id: board.error for board in boards if board.error}}
+
+    def history_json(self, boards, limit=None):
+        # The ?q=history of each board, serialized from its HistoryBuffer
+        items = [b'%s: %s' % (json.dumps(board.id).encode('utf-8'), board.history.to_json(None, limit))
+                 for board in boards]
+        return b'{"boards": {' + b', '.join(items) + b'}}'
+
+    def metrics(self):
+        # Prometheus text lines of the sweeps and of every board
+        lines = ['# TYPE gateway_sweep_seconds histogram']
+        lines += self.sweep_seconds.render('gateway_sweep_seconds')
+        lines.append('# TYPE gateway_board_up gauge')
+        for board in self.boards:
+            lines.append('gateway_board_up{board="%s"} %d' % (board.id, board.polls > 0 and not board.error))
+        lines.append('# TYPE gateway_board_polls_total counter')
+        for board in self.boards:
+            lines.append('gateway_board_polls_total{board="%s",result="ok"} %d'
+                         % (board.id, board.polls - board.failures))
+            lines.append('gateway_board_polls_total{board="%s",result="failed"} %d' % (board.id, board.failures))
+        lines.append('# TYPE gateway_board_samples gauge')
+        for board in self.boards:
+            lines.append('gateway_board_samples{board="%s"} %d' % (board.id, len(board.history)))
+        lines.append('# TYPE gateway_board_poll_seconds histogram')
+        for board in self.boards:
+            lines += board.poll_seconds.render('gateway_board_poll_seconds', 'board="%s"' % board.id)
+        return lines
+
+
+class GatewayHTTPServer(sever.SensorHTTPServer):
+    # Serves the merged responses of the Gateway. The responses are built from the
+    # cached samples, once per sweep that changed them, and never wait for a board.
+    gateway = None  # Class variable to hold the Gateway polling the boards
+    response_cache = sever.ResponseCache()
+    INDEX_PAGE = b"""
+                <html>
+                <head><title>Sensor Gateway</title></head>
+                <body>
+                    <h1>Sensor Gateway</h1>
+                    <p>Use the following queries to get data of all boards:</p>
+                    <ul>
+                        <li><a href="/?q=all">Latest data</a></li>
+                        <li><a href="/?q=history&limit=60">History data</a></li>
+                        <li><a href="/?q=metrics">Gateway metrics</a></li>
+                    </ul>
+                </body>
+                </html>
+            """
+    INDEX_HEADERS = b'Content-Type: text/html\r\nContent-Length: %d\r\n\r\n' % len(INDEX_PAGE)
+
+    @classmethod
+    def set_gateway(cls, gateway):
+        # Set the Gateway the handlers read from
+        cls.gateway = gateway
+
+    def handle_query(self, query, query_params):
+        # Handle the queries through the route table
+        if query in self.ROUTES:
+            self.ROUTES[query](self, query_params)
+        else:
+            self.send_fast(400, self.INDEX_HEADERS, self.INDEX_PAGE)
+
+    def selected_boards(self, query_params):
+        # Boards of board=id,id (all by default), None after answering 400 for an unknown ID
+        ids = query_params.get('board', [None])[0]
+        if not ids:
+            return self.gateway.boards
+        boards = [self.gateway.board(board_id) for board_id in ids.split(',')]
+        if None in boards:
+            self.send_error(400, "board must be among " + ','.join(board.id for board in self.gateway.boards))
+            return None
+        return boards
+
+    def handle_all(self, query_params):
+        # Handle requests for the latest data of the boards
+        boards = self.selected_boards(query_params)
+        if boards is None:
+            return
+        key = ('all', tuple(board.id for board in boards))
+        self.send_cached(self.response_cache.get(
+            key, self.gateway.version, lambda: sever.json_response(self.gateway.latest(boards))))
+
+    def handle_history(self, query_params):
+        # Handle requests for the history of the boards, limit=N keeps the newest N samples of each
+        boards = self.selected_boards(query_params)
+        if boards is None:
+            return
+        limit = query_params.get('limit', [None])[0]
+        try:
+            limit = max(int(limit), 0) if limit else None
+        except ValueError:
+            self.send_error(400, "Invalid limit")
+            return
+        key = ('history', tuple(board.id for board in boards), limit)
+        self.send_cached(self.response_cache.get(
+            key, self.gateway.version,
+            lambda: sever.CachedResponse(self.gateway.history_json(boards, limit), 'application/json')))
+
+    def handle_metrics(self, query_params):
+        # Handle requests for the gateway metrics in the Prometheus text format
+        lines = self.gateway.metrics()
+        lines.append('# TYPE gateway_http_request_seconds histogram')
+        for query, histogram in self.request_seconds.items():
+            lines += histogram.render('gateway_http_request_seconds', 'query="%s"' % (query or 'other'))
+        body = ('\n'.join(lines) + '\n').encode('utf-8')
+        self.send_cached(sever.CachedResponse(body, 'text/plain; version=0.0.4; charset=utf-8'))
+
+    ROUTES = {'all': handle_all,
+              'history': handle_history,
+              'metrics': handle_metrics}
+    # Duration of do_GET per query, unknown queries are counted under None
+    request_seconds = {query: sever.Histogram() for query in list(ROUTES) + [None]}
+
+
+def parse_board(spec, timeout=POLL_TIMEOUT, capacity=GATEWAY_HISTORY):
+    # Board of an id=url argument, the ID defaults to host:port of the url
+    board_id, _, url = spec.partition('=') if '=' in spec.split('?')[0] else ('', '', spec)
+    return Board(board_id, url, timeout, capacity)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Poll many boards running sever.py and serve their data merged")
+    parser.add_argument('boards', nargs='*', help="boards as id=url or url, e.g. lab=http://10.0.0.11:8080")
+    parser.add_argument('--boards', dest='board_file', help="file with one board per line (# starts a comment)")
+    parser.add_argument('--port', type=int, default=GATEWAY_PORT, help=f"HTTP port (default {GATEWAY_PORT})")
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL,
+                        help=f"seconds between sweeps (default {POLL_INTERVAL:g})")
+    parser.add_argument('--timeout', type=float, default=POLL_TIMEOUT,
+                        help=f"seconds per board and poll (default {POLL_TIMEOUT:g})")
+    parser.add_argument('--jitter', type=float, default=POLL_JITTER,
+                        help=f"spread of the polls over this fraction of the interval (default {POLL_JITTER:g})")
+    parser.add_argument('--history', type=int, default=GATEWAY_HISTORY,
+                        help=f"samples kept per board (default {GATEWAY_HISTORY})")
+    parser.add_argument('--once', action='store_true', help="poll every board once, print ?q=all and exit")
+    args = parser.parse_args()
+
+    specs = list(args.boards)
+    if args.board_file:
+        with open(args.board_file) as file:
+            specs += [line.split('#')[0].strip() for line in file if line.split('#')[0].strip()]
+    if not specs:
+        parser.error("no boards given")
+    boards = [parse_board(spec, args.timeout, args.history) for spec in specs]
+    if len(set(board.id for board in boards)) < len(boards):
+        parser.error("board IDs must be unique")
+    gateway = Gateway(boards, args.interval, args.jitter)
+
+    if args.once:
+        async def once():
+            try:
+                await gateway.sweep()
+            finally:
+                gateway.close()
+        asyncio.run(once())
+        print(json.dumps(gateway.latest(boards), indent=2))
+        print(f"Polled {len(boards)} boards in {gateway.last_sweep:.3f} s")
+        return
+
+    gateway.start()
+    GatewayHTTPServer.set_gateway(gateway)
+    httpd = ThreadingHTTPServer(('', args.port), GatewayHTTPServer)
+    print(f"Gateway polling {len(boards)} boards on port {args.port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        gateway.stop()
+
+
+if __name__ == "__main__":
+    main()
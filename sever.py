@@ -23,28 +23,127 @@ The above copyright notice and this permission notice shall be included in all c
 # pip install smbus2 qrcode requests pillow pyperclip
 # pip install RPi.GPIO
 # pip install smbus2 qrcode requests pyperclip
+# pip install numpy    (optional, vectorized DPS310 batch compensation)
 
-import smbus2
 import time
 import json
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from socketserver import ThreadingMixIn
 import socket
-import requests
-import qrcode
-from tkinter import Tk, Label, Text, Scrollbar, VERTICAL, Button, END, PhotoImage
-import pyperclip
-from threading import Thread
+import argparse
+import sys
+from threading import Thread, Lock, RLock, Event
 import io
+import gzip
+import hashlib
+import queue
+import os
+import mmap
+import struct
+import atexit
+import signal
+import multiprocessing
+from multiprocessing import shared_memory
+from bisect import bisect_left
+import math
+import random
 from datetime import datetime
-import RPi.GPIO as GPIO
+from email.utils import formatdate
+from collections import namedtuple, deque
+from array import array
 
 from urllib.parse import urlparse, parse_qs
-from PIL import Image, ImageTk
+# tkinter, qrcode, PIL, pyperclip and requests are imported by WebUI and
+# get_public_ip() when the window is opened, so --headless starts without them
+
+# NumPy is optional and imported by load_numpy() on the first batch compensation,
+# importing it would take longer than starting the rest of the server
+numpy = None
+numpy_checked = False
+
+# The hardware backends are optional so the server can run against the
+# simulated bus and GPIO of simulator.py on any machine
+try:
+    import smbus2
+except ImportError:
+    smbus2 = None
+try:
+    import RPi.GPIO as GPIO
+except (ImportError, RuntimeError):
+    GPIO = None  # Not a Raspberry Pi, see set_gpio_backend()
 
 # Define the I2C bus and the possible addresses of the DPS310
 I2C_BUS = 1
 DPS310_ADDRESSES = [0x77, 0x76]
 PORT = 8080
+HTTP_THREADED = True  # Serve every request in its own thread
+HTTP_KEEPALIVE_TIMEOUT = 5.0  # Seconds an idle kept-alive connection may wait for its next request
+HTTP_WORKERS = 0         # HTTP worker processes serving from shared memory, 0 to serve from the sampler process
+WORKER_PIPES = 4         # Concurrent requests of one worker to the sampler process (refresh, metrics)
+WORKER_POLL_INTERVAL = 0.05  # Seconds between the checks of a worker for new samples (?q=stream)
+STREAM_QUEUE_SIZE = 16   # Events buffered per ?q=stream client before its oldest are dropped
+STREAM_KEEPALIVE = 15.0  # Seconds between keep-alive comments on an idle stream
+GZIP_MIN_SIZE = 512      # Smallest response body worth compressing (bytes)
+RESPONSE_CACHE_SIZE = 64 # Serialized responses kept by the response cache
+LOG_FILE = None           # Request log file, rotated at LOG_FILE_MAX_BYTES, None for stdout only
+LOG_FILE_MAX_BYTES = 1000000
+LOG_FILE_BACKUPS = 3      # Rotated log files kept (LOG_FILE.1 ... LOG_FILE.3)
+LOG_QUEUE_SIZE = 10000    # Log lines waiting to be written before new ones are dropped
+LOG_FLUSH_INTERVAL = 0.25 # Seconds between batched log writes and Tk log updates
+LOG_UI_LINES = 500        # Lines kept in the log window
+# Upper bounds (seconds) of the ?q=metrics latency histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Default sampling schedule of the background sampler (seconds)
+SAMPLE_INTERVAL = 1.0    # DPS310 and GPIO inputs
+CO2_INTERVAL = 1.0       # PAS CO2 data-ready polling (a full measurement in single-shot mode)
+CO2_PERIOD = 10000       # PAS CO2 continuous measurement period (ms)
+CO2_DEFAULT_PRESSURE = 1013  # PAS CO2 pressure compensation until the DPS310 has measured (hPa)
+CO2_PRESSURE_THRESHOLD = 2   # Change of the measured pressure that is written to the PAS CO2 (hPa)
+
+HISTORY_CAPACITY = 86400  # Samples kept in memory (one day at 1 Hz)
+HISTORY_DEFAULT_LIMIT = 50  # Newest samples returned by ?q=history without since or limit
+HISTORY_LOG = 'history.dat'  # Append-only log of every sample, None to disable
+LOG_SYNC_INTERVAL = 10.0  # Seconds between fsync calls of the sample log
+LOG_INDEX_STRIDE = 64     # Records per entry of the sparse timestamp index
+
+# Rollup levels for downsampled history: (seconds per bucket, buckets kept)
+ROLLUP_LEVELS = [(10, 8640),     # 1 day
+                 (60, 10080),    # 1 week
+                 (600, 10080),   # 10 weeks
+                 (3600, 8784)]   # 1 year
+ROLLUP_OVERSAMPLE = 4  # Use the finest level with at most points * ROLLUP_OVERSAMPLE buckets
+ROLLUP_MAX_POINTS = 10000  # Larger points=N requests are answered with this many points
+
+# Sliding windows of the rolling statistics of ?q=stats: (name, seconds)
+STATS_WINDOWS = [('1m', 60), ('15m', 900), ('1h', 3600)]
+
+# Push of every sample to a central collector, see Uplink
+UPLINK_URL = None           # Collector URL the batches are POSTed to, None to disable
+UPLINK_BATCH_SIZE = 60      # Samples per POST at most
+UPLINK_MAX_DELAY = 10.0     # Seconds a sample waits for its batch to fill
+UPLINK_TIMEOUT = 10.0       # Seconds per POST before the collector counts as unreachable
+UPLINK_SPOOL = 'uplink-spool'  # Directory of the batches not delivered yet, None to drop them
+UPLINK_SPOOL_MAX_BYTES = 50000000  # Spool size at which the oldest batches are dropped
+UPLINK_BACKOFF = (1.0, 300.0)  # Seconds between delivery attempts after failures (first, longest)
+UPLINK_QUEUE_SIZE = 10000   # Samples waiting for the sender before new ones are dropped
+
+# DPS310 calibration coefficient registers 0x10 - 0x21
+DPS310_COEF_START = 0x10
+DPS310_COEF_LENGTH = 18
+
+# DPS310 compensation scale factors and register codes per oversampling rate,
+# and register codes of the measurement rates (per second)
+DPS310_SCALE_FACTORS = {1: 524288, 2: 1572864, 4: 3670016, 8: 7864320,
+                        16: 253952, 32: 516096, 64: 1040384, 128: 2088960}
+DPS310_RATE_CODES = {1: 0, 2: 1, 4: 2, 8: 3, 16: 4, 32: 5, 64: 6, 128: 7}
+DPS310_FIFO_EMPTY = 0x800000  # Value read from an empty FIFO
+
+FAST_PRESSURE_RATE = 0    # DPS310 FIFO pressure rate (Hz, 1 - 128), 0 for command-style reads
+FAST_PRESSURE_OVERSAMPLING = 8  # Pressure oversampling in FIFO mode, rate * measurement time must stay below 1 s
+PRESSURE_TRACE_CAPACITY = 32 * 3600  # High-rate pressure samples kept (one hour at 32 Hz)
 
 # Define GPIO pins
 PIN35 = 35   # distance 0
@@ -54,16 +153,195 @@ PIN29 = 29   # button 1
 PIN31 = 31   # LED 0
 PIN33 = 33    # LED 1
 
+GPIO_EVENT_PINS = [PIN35, PIN36, PIN29]  # Inputs captured on every edge (button 0 is not set up)
+GPIO_BOUNCE_TIME = 10        # Debounce time of the edge capture (ms)
+GPIO_EVENT_CAPACITY = 10000  # GPIO transitions kept for ?q=gpio_events
+
 
 gpio31 =-1
 gpio33 =-1
 
+def set_gpio_backend(gpio):
+    # Replace the RPi.GPIO module, e.g. with simulator.SimulatedGPIO()
+    global GPIO
+    GPIO = gpio
+
+def load_numpy():
+    # Import NumPy once, None when it is not installed (DPS.compensate_batch() then
+    # falls back to the scalar formulas)
+    global numpy, numpy_checked
+    if not numpy_checked:
+        numpy_checked = True
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy
+
+class Histogram:
+    # Latency histogram for ?q=metrics. The buckets are allocated up front and
+    # observe() only increments counters, so it stays on in production.
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last one is +Inf
+        self.sum = 0.0
+        self.lock = Lock()
+
+    def observe(self, value):
+        # Record one duration in seconds
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def render(self, name, labels=''):
+        # Prometheus text lines of the histogram, with cumulative buckets
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        prefix = labels + ',' if labels else ''
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            lines.append('%s_bucket{%sle="%s"} %d' % (name, prefix, bound, cumulative))
+        suffix = '{%s}' % labels if labels else ''
+        lines.append('%s_sum%s %r' % (name, suffix, total))
+        lines.append('%s_count%s %d' % (name, suffix, cumulative))
+        return lines
+
+class I2CBus:
+    # Owns the one SMBus handle of the board and serializes access to it.
+    # Every call holds the lock, and `with bus.transaction():` keeps a
+    # multi-register sequence atomic against the other threads.
+    # smbus replaces smbus2.SMBus, e.g. with simulator.SimulatedBus().
+    def __init__(self, bus_number=I2C_BUS, smbus=None):
+        self.bus = smbus if smbus is not None else smbus2.SMBus(bus_number)  # Initialize the I2C bus
+        self.lock = RLock()
+        # Transactions and failed transactions per device address, for ?q=metrics
+        self.reads = {}
+        self.writes = {}
+        self.errors = {}
+
+    def transaction(self):
+        # Hold the bus for a sequence of reads / writes
+        return self.lock
+
+    def device(self, address):
+        # Return a handle bound to one device address
+        return I2CDevice(self, address)
+
+    def read_byte(self, address):
+        with self.lock:
+            self.reads[address] = self.reads.get(address, 0) + 1
+            try:
+                return self.bus.read_byte(address)
+            except IOError:
+                self.errors[address] = self.errors.get(address, 0) + 1
+                raise
+
+    def read_byte_data(self, address, register):
+        with self.lock:
+            self.reads[address] = self.reads.get(address, 0) + 1
+            try:
+                return self.bus.read_byte_data(address, register)
+            except IOError:
+                self.errors[address] = self.errors.get(address, 0) + 1
+                raise
+
+    def write_byte_data(self, address, register, value):
+        with self.lock:
+            self.writes[address] = self.writes.get(address, 0) + 1
+            try:
+                self.bus.write_byte_data(address, register, value)
+            except IOError:
+                self.errors[address] = self.errors.get(address, 0) + 1
+                raise
+
+    def read_i2c_block_data(self, address, register, length):
+        with self.lock:
+            self.reads[address] = self.reads.get(address, 0) + 1
+            try:
+                return self.bus.read_i2c_block_data(address, register, length)
+            except IOError:
+                self.errors[address] = self.errors.get(address, 0) + 1
+                raise
+
+    def metrics(self):
+        # Prometheus text lines of the transaction counters
+        lines = []
+        for name, counters in [('reads', self.reads), ('writes', self.writes), ('errors', self.errors)]:
+            lines.append('# TYPE sensor_i2c_%s_total counter' % name)
+            for address, count in sorted(counters.items()):
+                lines.append('sensor_i2c_%s_total{address="0x%02x"} %d' % (name, address, count))
+        return lines
+
+class I2CDevice:
+    # Per-device handle on a shared I2CBus. It remembers the value last written to
+    # each register so that write_register() can skip writes of configuration that
+    # is already programmed. Any I2C error forgets them, the device may have reset.
+    def __init__(self, bus, address):
+        self.bus = bus
+        self.address = address
+        self.registers = {}  # Value last written per register
+        self.skipped = 0  # Writes skipped by write_register()
+
+    def transaction(self):
+        return self.bus.transaction()
+
+    def read_byte_data(self, register):
+        try:
+            return self.bus.read_byte_data(self.address, register)
+        except IOError:
+            self.registers.clear()
+            raise
+
+    def write_byte_data(self, register, value):
+        try:
+            self.bus.write_byte_data(self.address, register, value)
+        except IOError:
+            self.registers.clear()
+            raise
+        self.registers[register] = value
+
+    def write_register(self, register, value):
+        # Write a configuration register unless it already holds value, returns whether it wrote
+        if self.registers.get(register) == value:
+            self.skipped += 1
+            return False
+        self.write_byte_data(register, value)
+        return True
+
+    def assume_register(self, register, value):
+        # Record a value the device set by itself, e.g. a mode it returned to
+        self.registers[register] = value
+
+    def read_i2c_block_data(self, register, length):
+        try:
+            return self.bus.read_i2c_block_data(self.address, register, length)
+        except IOError:
+            self.registers.clear()
+            raise
+
+# Raw FIFO result of the DPS310 with its reconstructed time, raw_temperature is
+# the latest temperature result at that time
+FifoSample = namedtuple('FifoSample', ['timestamp', 'raw_temperature', 'raw_pressure'])
+
+# Decoded DPS310 calibration coefficients, read once from the sensor PROM
+DPSCoefficients = namedtuple('DPSCoefficients', ['c0', 'c1', 'c00', 'c10', 'c20', 'c30', 'c01', 'c11', 'c21'])
+
 class DPS:
-    def __init__(self):
-        self.bus = smbus2.SMBus(I2C_BUS)  # Initialize the I2C bus
+    def __init__(self, bus=None):
+        self.bus = bus or I2CBus(I2C_BUS)  # Shared I2C bus
         self.addr = self.find_address()  # Find the I2C address of the sensor
+        self.device = self.bus.device(self.addr)  # I2C handle of the sensor
+        self.fifo_rate = 0  # Pressure rate while the FIFO is enabled, 0 when off
+        self.raw_temperature = None  # Latest raw temperature drained from the FIFO
+        self.read_pressure_seconds = Histogram()  # Duration of read_pressure()
+        self.read_snapshot_seconds = Histogram()  # Duration of read_snapshot()
         self.__correctTemperature()  # Correct temperature calibration
         self.__setOversamplingRate()  # Set oversampling rate
+        self.reload_coefficients()  # Cache the calibration coefficients
 
     def find_address(self):
         # Try to find the sensor on known addresses
@@ -84,33 +362,109 @@ class DPS:
 
     def __correctTemperature(self):
         # Correct the temperature readings
-        self.bus.write_byte_data(self.addr, 0x0E, 0xA5)
-        self.bus.write_byte_data(self.addr, 0x0F, 0x96)
-        self.bus.write_byte_data(self.addr, 0x62, 0x02)
-        self.bus.write_byte_data(self.addr, 0x0E, 0x00)
-        self.bus.write_byte_data(self.addr, 0x0F, 0x00)
+        with self.device.transaction():
+            self.device.write_byte_data(0x0E, 0xA5)
+            self.device.write_byte_data(0x0F, 0x96)
+            self.device.write_byte_data(0x62, 0x02)
+            self.device.write_byte_data(0x0E, 0x00)
+            self.device.write_byte_data(0x0F, 0x00)
 
     def __setOversamplingRate(self):
-        # Set the oversampling rate for temperature and pressure readings
-        self.bus.write_byte_data(self.addr, 0x06, 0x26)
-        self.bus.write_byte_data(self.addr, 0x07, 0xA6)
-        self.bus.write_byte_data(self.addr, 0x08, 0x07)
-        self.bus.write_byte_data(self.addr, 0x09, 0x0C)
+        # Set the oversampling rate for temperature and pressure readings (4 Hz, 64 times)
+        self.device.write_register(0x06, 0x26)
+        self.device.write_register(0x07, 0xA6)
+        self.device.write_register(0x08, 0x07)
+        self.device.write_register(0x09, 0x0C)
+        self.kT = self.kP = DPS310_SCALE_FACTORS[64]
+
+    def start_background_mode(self, pressure_rate=32, pressure_oversampling=8,
+                              temperature_rate=1, temperature_oversampling=1):
+        # Measure continuously into the on-chip FIFO, drained with read_fifo().
+        # The rates are per second, rate * measurement time of both must stay below 1 s.
+        shift = (0x04 if pressure_oversampling > 8 else 0) | (0x08 if temperature_oversampling > 8 else 0)
+        with self.device.transaction():
+            self.device.write_register(0x08, 0x00)  # Standby
+            self.device.write_register(0x06, (DPS310_RATE_CODES[pressure_rate] << 4)
+                                       | DPS310_RATE_CODES[pressure_oversampling])
+            self.device.write_register(0x07, 0x80 | (DPS310_RATE_CODES[temperature_rate] << 4)
+                                       | DPS310_RATE_CODES[temperature_oversampling])
+            self.device.write_register(0x09, shift | 0x02)  # FIFO_EN
+            self.device.write_byte_data(0x0C, 0x80)  # FIFO_FLUSH
+            self.device.write_register(0x08, 0x07)  # Continuous pressure and temperature
+        self.kP = DPS310_SCALE_FACTORS[pressure_oversampling]
+        self.kT = DPS310_SCALE_FACTORS[temperature_oversampling]
+        self.fifo_rate = pressure_rate
+        self.raw_temperature = None
+
+    def stop_background_mode(self):
+        # Disable the FIFO and go back to the default configuration
+        with self.device.transaction():
+            self.device.write_register(0x08, 0x00)
+            self.device.write_byte_data(0x0C, 0x80)
+            self.__setOversamplingRate()
+        self.fifo_rate = 0
+
+    def read_fifo(self):
+        # Drain the FIFO, one 3 byte block read per result, and return the pressure
+        # results as FifoSamples. Their times are spread back from now at the
+        # configured rate.
+        raw = []
+        with self.device.transaction():
+            while len(raw) < 32:
+                b2, b1, b0 = self.device.read_i2c_block_data(0x00, 3)
+                value = (b2 << 16) | (b1 << 8) | b0
+                if value == DPS310_FIFO_EMPTY:
+                    break
+                raw.append(value)
+        now = time.time()
+        count = sum(value & 1 for value in raw)
+        samples = []
+        for value in raw:
+            if value & 1:  # Pressure result
+                if self.raw_temperature is not None:
+                    timestamp = now - (count - 1 - len(samples)) / self.fifo_rate
+                    samples.append(FifoSample(timestamp, self.raw_temperature, self.getTwosComplement(value, 24)))
+                else:
+                    count -= 1
+            else:
+                self.raw_temperature = self.getTwosComplement(value, 24)
+        return samples
+
+    def compensate(self, raw_temperature, raw_pressure):
+        # Compensated (temperature, pressure) of one raw result pair
+        scaled_t = raw_temperature / self.kT
+        scaled_p = raw_pressure / self.kP
+        return self.calcCompTemperature(scaled_t), self.calcCompPressure(scaled_p, scaled_t)
+
+    def compensate_batch(self, raw_p, raw_t):
+        # Compensate sequences of raw pressure and temperature results in one go with
+        # the cached coefficients. Returns (temperatures, pressures), as NumPy arrays
+        # when NumPy is installed and as lists from the scalar formulas otherwise.
+        numpy = load_numpy()
+        if numpy is None:
+            results = [self.compensate(t, p) for p, t in zip(raw_p, raw_t)]
+            return [t for t, p in results], [p for t, p in results]
+        # The scalar formulas applied to whole arrays, so both paths compute the same
+        scaled_p = numpy.asarray(raw_p, dtype=numpy.float64) / self.kP
+        scaled_t = numpy.asarray(raw_t, dtype=numpy.float64) / self.kT
+        return self.calcCompTemperature(scaled_t), self.calcCompPressure(scaled_p, scaled_t)
 
     def __getRawTemperature(self):
         # Read raw temperature data from the sensor
-        t1 = self.bus.read_byte_data(self.addr, 0x03)
-        t2 = self.bus.read_byte_data(self.addr, 0x04)
-        t3 = self.bus.read_byte_data(self.addr, 0x05)
+        with self.device.transaction():
+            t1 = self.device.read_byte_data(0x03)
+            t2 = self.device.read_byte_data(0x04)
+            t3 = self.device.read_byte_data(0x05)
         t = (t1 << 16) | (t2 << 8) | t3
         t = self.getTwosComplement(t, 24)
         return t
 
     def __getRawPressure(self):
         # Read raw pressure data from the sensor
-        p1 = self.bus.read_byte_data(self.addr, 0x00)
-        p2 = self.bus.read_byte_data(self.addr, 0x01)
-        p3 = self.bus.read_byte_data(self.addr, 0x02)
+        with self.device.transaction():
+            p1 = self.device.read_byte_data(0x00)
+            p2 = self.device.read_byte_data(0x01)
+            p3 = self.device.read_byte_data(0x02)
         p = (p1 << 16) | (p2 << 8) | p3
         p = self.getTwosComplement(p, 24)
         return p
@@ -118,79 +472,68 @@ class DPS:
     def calcScaledTemperature(self):
         # Calculate scaled temperature
         raw_t = self.__getRawTemperature()
-        scaled_t = raw_t / 1040384  # __kT = 1040384
+        scaled_t = raw_t / self.kT
         return scaled_t
 
     def calcCompTemperature(self, scaled_t):
         # Calculate compensated temperature
-        c0, c1 = self.__getTemperatureCalibrationCoefficients()
-        comp_t = c0 * 0.5 + scaled_t * c1
+        c = self.coefficients
+        comp_t = c.c0 * 0.5 + scaled_t * c.c1
         return comp_t
 
     def calcScaledPressure(self):
         # Calculate scaled pressure
         raw_p = self.__getRawPressure()
-        scaled_p = raw_p / 1040384  # __kP = 1040384
+        scaled_p = raw_p / self.kP
         return scaled_p
 
     def calcCompPressure(self, scaled_p, scaled_t):
         # Calculate compensated pressure
-        c00, c10, c20, c30, c01, c11, c21 = self.__getPressureCalibrationCoefficients()
-        comp_p = (c00 + scaled_p * (c10 + scaled_p * (c20 + scaled_p * c30))
-                  + scaled_t * (c01 + scaled_p * (c11 + scaled_p * c21)))
+        c = self.coefficients
+        comp_p = (c.c00 + scaled_p * (c.c10 + scaled_p * (c.c20 + scaled_p * c.c30))
+                  + scaled_t * (c.c01 + scaled_p * (c.c11 + scaled_p * c.c21)))
         return comp_p
 
-    def __getTemperatureCalibrationCoefficients(self):
-        # Get temperature calibration coefficients from the sensor
-        src10 = self.bus.read_byte_data(self.addr, 0x10)
-        src11 = self.bus.read_byte_data(self.addr, 0x11)
-        src12 = self.bus.read_byte_data(self.addr, 0x12)
-        c0 = (src10 << 4) | (src11 >> 4)
+    def reload_coefficients(self):
+        # Read the calibration coefficient block (0x10 - 0x21) in one burst and cache it.
+        # The coefficients live in the sensor PROM, so this is only needed at start-up
+        # or after a soft reset.
+        block = self.device.read_i2c_block_data(DPS310_COEF_START, DPS310_COEF_LENGTH)
+        self.coefficients = self.decode_coefficients(block)
+        return self.coefficients
+
+    def decode_coefficients(self, block):
+        # Decode the raw 18 byte coefficient block into a DPSCoefficients tuple
+        src = [0] * 0x10 + list(block)
+
+        c0 = (src[0x10] << 4) | (src[0x11] >> 4)
         c0 = self.getTwosComplement(c0, 12)
-        c1 = ((src11 & 0x0F) << 8) | src12
+
+        c1 = ((src[0x11] & 0x0F) << 8) | src[0x12]
         c1 = self.getTwosComplement(c1, 12)
-        return c0, c1
-
-    def __getPressureCalibrationCoefficients(self):
-        # Get pressure calibration coefficients from the sensor
-        src13 = self.bus.read_byte_data(self.addr, 0x13)
-        src14 = self.bus.read_byte_data(self.addr, 0x14)
-        src15 = self.bus.read_byte_data(self.addr, 0x15)
-        src16 = self.bus.read_byte_data(self.addr, 0x16)
-        src17 = self.bus.read_byte_data(self.addr, 0x17)
-        src18 = self.bus.read_byte_data(self.addr, 0x18)
-        src19 = self.bus.read_byte_data(self.addr, 0x19)
-        src1A = self.bus.read_byte_data(self.addr, 0x1A)
-        src1B = self.bus.read_byte_data(self.addr, 0x1B)
-        src1C = self.bus.read_byte_data(self.addr, 0x1C)
-        src1D = self.bus.read_byte_data(self.addr, 0x1D)
-        src1E = self.bus.read_byte_data(self.addr, 0x1E)
-        src1F = self.bus.read_byte_data(self.addr, 0x1F)
-        src20 = self.bus.read_byte_data(self.addr, 0x20)
-        src21 = self.bus.read_byte_data(self.addr, 0x21)
-
-        c00 = (src13 << 12) | (src14 << 4) | (src15 >> 4)
+
+        c00 = (src[0x13] << 12) | (src[0x14] << 4) | (src[0x15] >> 4)
         c00 = self.getTwosComplement(c00, 20)
 
-        c10 = ((src15 & 0x0F) << 16) | (src16 << 8) | src17
+        c10 = ((src[0x15] & 0x0F) << 16) | (src[0x16] << 8) | src[0x17]
         c10 = self.getTwosComplement(c10, 20)
 
-        c20 = (src1C << 8) | src1D
+        c20 = (src[0x1C] << 8) | src[0x1D]
         c20 = self.getTwosComplement(c20, 16)
 
-        c30 = (src20 << 8) | src21
+        c30 = (src[0x20] << 8) | src[0x21]
         c30 = self.getTwosComplement(c30, 16)
 
-        c01 = (src18 << 8) | src19
+        c01 = (src[0x18] << 8) | src[0x19]
         c01 = self.getTwosComplement(c01, 16)
 
-        c11 = (src1A << 8) | src1B
+        c11 = (src[0x1A] << 8) | src[0x1B]
         c11 = self.getTwosComplement(c11, 16)
 
-        c21 = (src1E << 8) | src1F
+        c21 = (src[0x1E] << 8) | src[0x1F]
         c21 = self.getTwosComplement(c21, 16)
 
-        return c00, c10, c20, c30, c01, c11, c21
+        return DPSCoefficients(c0, c1, c00, c10, c20, c30, c01, c11, c21)
 
     def read_temperature(self):
         # Read and return the compensated temperature
@@ -200,24 +543,46 @@ class DPS:
 
     def read_pressure(self):
         # Read and return the compensated pressure
-        scaled_t = self.calcScaledTemperature()
-        scaled_p = self.calcScaledPressure()
+        start = time.perf_counter()
+        with self.device.transaction():
+            scaled_t = self.calcScaledTemperature()
+            scaled_p = self.calcScaledPressure()
         pressure = self.calcCompPressure(scaled_p, scaled_t)
+        self.read_pressure_seconds.observe(time.perf_counter() - start)
         return pressure
 
+    def read_snapshot(self):
+        # Read the pressure and temperature results (0x00 - 0x05) in one burst and
+        # return the compensated (temperature, pressure) of the same instant
+        start = time.perf_counter()
+        p1, p2, p3, t1, t2, t3 = self.device.read_i2c_block_data(0x00, 6)
+        raw_p = self.getTwosComplement((p1 << 16) | (p2 << 8) | p3, 24)
+        raw_t = self.getTwosComplement((t1 << 16) | (t2 << 8) | t3, 24)
+        snapshot = self.compensate(raw_t, raw_p)
+        self.read_snapshot_seconds.observe(time.perf_counter() - start)
+        return snapshot
+
 class PA_CO2:
-    def __init__(self, device_address=0x28, period=10000):
+    def __init__(self, device_address=0x28, period=10000, continuous=False, bus=None):
         self.device_address = device_address  # Set device address
-        self.period = period  # Set measurement period
-        self.bus = smbus2.SMBus(1)  # Initialize the I2C bus
+        self.period = period  # Set measurement period (ms), used in continuous mode
+        self.continuous = False  # True once continuous mode is programmed
+        self.ppm = None  # Last CO2 value read in continuous mode
+        self.pressure_hpa = CO2_DEFAULT_PRESSURE  # Pressure used for the compensation (hPa)
+        self.measure_seconds = Histogram()  # Duration of single-shot measure_co2()
+        self.read_new_ppm_seconds = Histogram()  # Duration of read_new_ppm() in continuous mode
+        self.bus = bus or I2CBus(I2C_BUS)  # Shared I2C bus
+        self.device = self.bus.device(device_address)  # I2C handle of the sensor
+        if continuous:
+            self.start_continuous_mode()
         
     def read_byte(self, command):
         # Read a byte from the given command register
-        return self.bus.read_byte_data(self.device_address, command)
+        return self.device.read_byte_data(command)
     
     def write_byte(self, command, value):
         # Write a byte to the given command register
-        self.bus.write_byte_data(self.device_address, command, value)
+        self.device.write_byte_data(command, value)
     
     def check_sensor_status(self):
         # Check the sensor status
@@ -225,14 +590,28 @@ class PA_CO2:
         return status
     
     def set_idle_mode(self):
-        # Set the sensor to idle mode
-        self.write_byte(0x04, 0x00)
-        time.sleep(0.4)
+        # Set the sensor to idle mode, nothing to do when it is idle already
+        if self.device.write_register(0x04, 0x00):
+            time.sleep(0.4)
     
-    def set_pressure(self, high_byte=0x03, low_byte=0xF5):
-        # Set the pressure compensation
-        self.write_byte(0x0B, high_byte)
-        self.write_byte(0x0C, low_byte)
+    def set_pressure(self, high_byte=None, low_byte=None):
+        # Set the pressure compensation (hPa), by default to pressure_hpa. Values that
+        # are programmed already are not written again.
+        if high_byte is None:
+            high_byte, low_byte = self.pressure_hpa >> 8, self.pressure_hpa & 0xFF
+        with self.device.transaction():
+            self.device.write_register(0x0B, high_byte)
+            self.device.write_register(0x0C, low_byte)
+        self.pressure_hpa = (high_byte << 8) | low_byte
+
+    def update_pressure(self, pressure, threshold=CO2_PRESSURE_THRESHOLD):
+        # Use a measured pressure (Pa) for the compensation once it differs from the
+        # programmed one by threshold hPa or more
+        if pressure is None or pressure != pressure:
+            return
+        hpa = max(750, min(1150, int(round(pressure / 100))))  # Range of the sensor
+        if abs(hpa - self.pressure_hpa) >= threshold:
+            self.set_pressure(hpa >> 8, hpa & 0xFF)
     
     def trigger_measurement(self):
         # Trigger a CO2 measurement
@@ -240,54 +619,1735 @@ class PA_CO2:
         time.sleep(1.15)
     
     def get_ppm_value(self):
-        # Get the CO2 concentration in ppm
-        value1 = self.read_byte(0x05)
-        time.sleep(0.005)
-        value2 = self.read_byte(0x06)
-        time.sleep(0.005)
+        # Get the CO2 concentration in ppm, both bytes in one block read like
+        # read_new_ppm(), so the bus is not held while waiting
+        value1, value2 = self.device.read_i2c_block_data(0x05, 2)
         result = (value1 << 8) | value2
         return result
+
+    def set_measurement_rate(self, period):
+        # Program the continuous measurement period, given in ms (5 - 4095 s on the sensor)
+        rate = max(5, min(4095, round(period / 1000)))
+        with self.device.transaction():
+            self.device.write_register(0x02, rate >> 8)
+            self.device.write_register(0x03, rate & 0xFF)
+
+    def start_continuous_mode(self):
+        # Program the measurement period once and let the sensor measure on its own
+        self.set_idle_mode()
+        self.set_pressure()
+        self.set_measurement_rate(self.period)
+        self.write_byte(0x04, 0x02)
+        self.continuous = True
+
+    def stop_continuous_mode(self):
+        # Return to idle mode, measure_co2() falls back to single-shot
+        self.set_idle_mode()
+        self.continuous = False
+
+    def data_ready(self):
+        # Check the data-ready bit of the measurement status register
+        return bool(self.read_byte(0x07) & 0x10)
+
+    def read_new_ppm(self):
+        # Return the new CO2 sample in ppm, or None if the sensor has none yet
+        start = time.perf_counter()
+        with self.device.transaction():
+            ready = self.data_ready()
+            if ready:
+                value1, value2 = self.device.read_i2c_block_data(0x05, 2)
+        self.read_new_ppm_seconds.observe(time.perf_counter() - start)
+        if not ready:
+            return None
+        self.ppm = (value1 << 8) | value2
+        return self.ppm
     
     def measure_co2(self):
         # Measure CO2 concentration and return the value in ppm
+        if self.continuous:
+            ppm = self.read_new_ppm()
+            return self.ppm if ppm is None else ppm
+        start = time.perf_counter()
         self.set_idle_mode()
         self.set_pressure()
         self.trigger_measurement()
         ppm = self.get_ppm_value()
+        self.device.assume_register(0x04, 0x00)  # Back in idle mode after a single shot
+        self.measure_seconds.observe(time.perf_counter() - start)
         return ppm
 
+# Immutable set of the latest readings, published by SensorSampler
+Snapshot = namedtuple('Snapshot', ['temperature', 'pressure', 'co2',
+                                   'gpio35', 'gpio36', 'gpio27', 'gpio29', 'gpio31', 'gpio33',
+                                   'date_time', 'timestamp', 'seq'])
+
+# One compensated high-rate pressure sample drained from the DPS310 FIFO
+PressureSample = namedtuple('PressureSample', ['temperature', 'pressure', 'time', 'seq'])
+
+class SingleFlight:
+    # Runs at most one call of fn at a time. Callers arriving while it runs wait
+    # for that call and share its result (or exception) instead of starting another.
+    def __init__(self, fn):
+        self.fn = fn
+        self.__name__ = fn.__name__
+        self.lock = Lock()
+        self.call = None  # [done Event, result, exception] of the call in flight
+
+    def __call__(self):
+        with self.lock:
+            call = self.call
+            leader = call is None
+            if leader:
+                call = self.call = [Event(), None, None]
+        if leader:
+            try:
+                call[1] = self.fn()
+            except Exception as e:
+                call[2] = e
+            finally:
+                with self.lock:
+                    self.call = None
+                call[0].set()
+        else:
+            call[0].wait()
+        if call[2] is not None:
+            raise call[2]
+        return call[1]
+
+    def start(self):
+        # Run a call in the background unless one is in flight already
+        if self.call is not None:
+            return
+        thread = Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        try:
+            self()
+        except (IOError, OSError, RuntimeError) as e:
+            log(f"Refresh error in {self.__name__}: {e}")
+
+class SensorSampler:
+    def __init__(self, dps, co2_sensor, interval=SAMPLE_INTERVAL, co2_interval=CO2_INTERVAL, trace=None):
+        self.dps = dps  # DPS310 temperature / pressure sensor
+        self.co2_sensor = co2_sensor  # PAS CO2 sensor
+        self.interval = interval  # Seconds between DPS / GPIO samples
+        self.co2_interval = co2_interval  # Seconds between CO2 measurements
+        self.snapshot = Snapshot(None, None, None, -1, -1, -1, -1, gpio31, gpio33, None, 0, 0)
+        self.ready = Event()  # Set once the first snapshot is published
+        self.running = False
+        self.lock = Lock()  # Serializes snapshot updates from the sampling threads
+        self.threads = []
+        self.listeners = []  # (callable, channels) called with every published snapshot
+        self.trace = trace  # PressureTrace for the FIFO samples in background mode
+        self.trace_seq = 0
+        self.fifo_latest = None  # Newest compensated (temperature, pressure) from the FIFO
+        # How late each sampling task starts against its schedule, for ?q=metrics
+        self.lag = {'sample_dps': Histogram(), 'sample_co2': Histogram(), 'drain_fifo': Histogram()}
+        # The scheduled samples and the on-demand refreshes of ?max_age= share these,
+        # so a sensor is never read by two callers at once
+        self.flights = {'dps': SingleFlight(self.sample_dps), 'co2': SingleFlight(self.sample_co2)}
+        self.measured = {}  # Time of the newest value per channel
+
+    def add_listener(self, listener, channels=False):
+        # Register a callable that receives every new snapshot, it must not block. With
+        # channels it also receives the analog channels measured for that snapshot; the
+        # other channels hold their previous values.
+        self.listeners.append((listener, channels))
+
+    def start(self):
+        # Start the sampling threads
+        self.running = True
+        self.threads = [Thread(target=self.run, args=(self.interval, self.flights['dps'])),
+                        Thread(target=self.run, args=(self.co2_interval, self.flights['co2']))]
+        if self.dps.fifo_rate:
+            # Drain the 32 entry FIFO when it is about half full
+            self.threads.append(Thread(target=self.run, args=(16 / self.dps.fifo_rate, self.drain_fifo)))
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        # Stop the sampling threads after their current sample
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+
+    def run(self, interval, sample):
+        # Call sample() every interval seconds until stopped
+        lag = self.lag[sample.__name__]
+        next_time = time.monotonic()
+        while self.running:
+            try:
+                sample()
+            except (IOError, OSError, RuntimeError) as e:
+                log(f"Sampler error in {sample.__name__}: {e}")
+            next_time += interval
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+                lag.observe(time.monotonic() - next_time)
+            else:
+                lag.observe(-delay)
+                next_time = time.monotonic()
+
+    def sample_dps(self):
+        # Read temperature, pressure and the GPIO inputs, in background mode
+        # temperature and pressure are the newest values drained from the FIFO
+        if self.dps.fifo_rate:
+            if self.fifo_latest is None:
+                return
+            temperature, pressure = self.fifo_latest
+        else:
+            temperature, pressure = self.dps.read_snapshot()
+        self.measured['dps'] = time.time()
+        self.publish(temperature=temperature,
+                     pressure=pressure,
+                     gpio35=GPIO.input(PIN35),
+                     gpio36=GPIO.input(PIN36),
+                     gpio27=-1,  # GPIO.input(PIN27), button 0 is not set up
+                     gpio29=GPIO.input(PIN29),
+                     gpio31=gpio31,
+                     gpio33=gpio33)
+
+    def drain_fifo(self):
+        # Compensate the samples waiting in the DPS310 FIFO and add them to the trace
+        samples = self.dps.read_fifo()
+        if not samples:
+            return
+        temperatures, pressures = self.dps.compensate_batch([sample.raw_pressure for sample in samples],
+                                                            [sample.raw_temperature for sample in samples])
+        self.fifo_latest = (float(temperatures[-1]), float(pressures[-1]))
+        if self.trace is not None:
+            for sample, temperature, pressure in zip(samples, temperatures, pressures):
+                self.trace_seq += 1
+                self.trace.append(PressureSample(temperature, pressure, sample.timestamp, self.trace_seq))
+
+    def sample_co2(self):
+        # Measure CO2 concentration, in continuous mode only publish new samples.
+        # The latest DPS310 pressure is used for the compensation of the measurement.
+        self.co2_sensor.update_pressure(self.snapshot.pressure)
+        if self.co2_sensor.continuous:
+            ppm = self.co2_sensor.read_new_ppm()
+            if ppm is None:
+                return
+        else:
+            ppm = self.co2_sensor.measure_co2()
+        self.measured['co2'] = time.time()
+        self.publish(co2=ppm)
+
+    def age(self, channel):
+        # Seconds since the newest value of channel ('dps' or 'co2') was measured
+        return time.time() - self.measured.get(channel, 0.0)
+
+    def refresh(self, channels, max_age, wait=False):
+        # Measure the channels whose values are older than max_age seconds again, in
+        # the background or, with wait, before returning. Concurrent refreshes and the
+        # scheduled samples share one measurement. Returns the age of the oldest value.
+        for channel in channels:
+            if self.age(channel) > max_age:
+                if wait:
+                    self.flights[channel].run()
+                else:
+                    self.flights[channel].start()
+        return max(self.age(channel) for channel in channels)
+
+    def publish(self, **values):
+        # Replace the latest snapshot with a copy holding the new values and the next sequence number
+        now = time.time()
+        measured = [channel for channel in RollupLevel.CHANNELS if channel in values]
+        with self.lock:
+            self.snapshot = self.snapshot._replace(
+                date_time=datetime.fromtimestamp(now).strftime('%Y-%m-%d %H:%M:%S'),
+                timestamp=now, seq=self.snapshot.seq + 1, **values)
+            self.ready.set()
+            for listener, channels in self.listeners:
+                if channels:
+                    listener(self.snapshot, measured)
+                else:
+                    listener(self.snapshot)
+
+    def latest(self, timeout=None):
+        # Return the latest snapshot, waiting for the first one if needed
+        self.ready.wait(timeout)
+        return self.snapshot
+
+    def is_ready(self, channels):
+        # True once a snapshot is published and one of channels ('dps', 'co2') has
+        # been measured, an empty channels needs no measurement
+        return self.ready.is_set() and (not channels or any(channel in self.measured for channel in channels))
+
+    def metrics(self):
+        # Prometheus lines of the I2C buses, the sensor reads and the sampling schedule
+        lines = []
+        dps = self.dps
+        co2_sensor = self.co2_sensor
+        buses = [dps.bus] if co2_sensor.bus is dps.bus else [dps.bus, co2_sensor.bus]
+        for bus in buses:
+            lines += bus.metrics()
+        lines.append('# TYPE sensor_i2c_writes_skipped_total counter')
+        for device in (dps.device, co2_sensor.device):
+            lines.append('sensor_i2c_writes_skipped_total{address="0x%02x"} %d' % (device.address, device.skipped))
+        for name, histogram in [('sensor_dps_read_pressure_seconds', dps.read_pressure_seconds),
+                                ('sensor_dps_read_snapshot_seconds', dps.read_snapshot_seconds),
+                                ('sensor_co2_measure_seconds', co2_sensor.measure_seconds),
+                                ('sensor_co2_read_new_ppm_seconds', co2_sensor.read_new_ppm_seconds)]:
+            lines.append('# TYPE %s histogram' % name)
+            lines += histogram.render(name)
+        lines.append('# TYPE sensor_sampler_lag_seconds histogram')
+        for task, histogram in self.lag.items():
+            lines += histogram.render('sensor_sampler_lag_seconds', 'task="%s"' % task)
+        snapshot = self.snapshot
+        lines.append('# TYPE sensor_snapshot_age_seconds gauge')
+        lines.append('sensor_snapshot_age_seconds %r' % (time.time() - snapshot.timestamp if snapshot.timestamp else -1))
+        lines.append('# TYPE sensor_samples_published_total counter')
+        lines.append('sensor_samples_published_total %d' % snapshot.seq)
+        return lines
+
+class HistoryBuffer:
+    # Fixed-capacity ring buffer of samples, stored column by column in typed arrays.
+    # Appending overwrites the oldest sample in O(1); no per-sample Python objects are kept.
+    COLUMNS = [('temperature', 'd'), ('pressure', 'd'), ('co2', 'i'),
+               ('gpio27', 'b'), ('gpio29', 'b'), ('gpio31', 'b'), ('gpio33', 'b'),
+               ('gpio35', 'b'), ('gpio36', 'b'), ('timestamp', 'd')]
+    MISSING = {'d': float('nan'), 'i': -1}  # Stored for values not measured yet
+
+    def __init__(self, capacity=HISTORY_CAPACITY):
+        self.capacity = capacity
+        self.columns = self.create_columns()
+        self.start = 0  # Index of the oldest sample
+        self.count = 0  # Number of samples stored
+        self.last_seq = 0  # Sequence number of the newest sample, samples are consecutive
+        self.lock = Lock()
+
+    def __len__(self):
+        return self.count
+
+    def create_columns(self):
+        # Allocate the zeroed columns, see SharedBuffer for columns in shared memory
+        return {name: array(typecode, [0]) * self.capacity for name, typecode in self.COLUMNS}
+
+    def read(self, method, *args):
+        # Call method, which reads the buffer, without a concurrent append
+        with self.lock:
+            return method(*args)
+
+    def append(self, snapshot):
+        # Store one snapshot, evicting the oldest sample when full
+        with self.lock:
+            self.last_seq = snapshot.seq
+            if self.count < self.capacity:
+                index = (self.start + self.count) % self.capacity
+                self.count += 1
+            else:
+                index = self.start
+                self.start = (self.start + 1) % self.capacity
+            for name, typecode in self.COLUMNS:
+                value = getattr(snapshot, name)
+                self.columns[name][index] = self.MISSING.get(typecode, -1) if value is None else value
+
+    def slices(self):
+        # Return the (start, stop) index ranges holding the samples, oldest first
+        end = self.start + self.count
+        if end <= self.capacity:
+            return [(self.start, end)]
+        return [(self.start, self.capacity), (0, end - self.capacity)]
+
+    def oldest(self):
+        # Timestamp of the oldest sample, None when empty
+        return self.read(lambda: self.columns['timestamp'][self.start] if self.count else None)
+
+    def ordered(self, name, skip=0):
+        # Copy one column in chronological order without its skip oldest samples, inside read()
+        values = memoryview(self.columns[name])
+        result = array(values.format)
+        for lo, hi in self.slices():
+            if skip >= hi - lo:
+                skip -= hi - lo
+                continue
+            result.frombytes(values[lo + skip:hi].cast('B'))
+            skip = 0
+        return result
+
+    def column(self, name):
+        # Return a copy of one column in chronological order
+        return self.read(self.ordered, name)
+
+    def select(self, since=None, limit=None):
+        # Copies of the columns holding the samples to_json() returns, and the newest
+        # sequence number, inside read()
+        count = self.count
+        if since is not None and since <= self.last_seq:
+            count = max(min(self.last_seq - since, count), 0)
+        if limit is not None:
+            count = min(count, limit)
+        return [(name, self.ordered(name, self.count - count)) for name, typecode in self.COLUMNS], self.last_seq
+
+    def to_json(self, since=None, limit=None):
+        # Serialize the history straight from the columns, in the ?q=history format.
+        # since keeps the samples newer than that sequence number, limit the newest ones,
+        # and "seq" is the cursor for the next since query. A since beyond the newest
+        # sample comes from before a restart and returns everything.
+        columns, last_seq = self.read(self.select, since, limit)
+        fields = ['"%s": [%s]' % (json_name(name), ', '.join(json_items(name, values.typecode, values)))
+                  for name, values in columns]
+        fields.append('"seq": %d' % last_seq)
+        return ('{' + ', '.join(fields) + '}').encode('utf-8')
+
+class PressureTrace(HistoryBuffer):
+    # Ring buffer of the high-rate pressure samples drained from the DPS310 FIFO,
+    # with sub-second times as epoch seconds
+    COLUMNS = [('temperature', 'd'), ('pressure', 'd'), ('time', 'd')]
+
+# One captured GPIO transition: pin number, new level and time as epoch seconds
+GpioEvent = namedtuple('GpioEvent', ['pin', 'level', 'time', 'seq'])
+
+class GpioEvents(HistoryBuffer):
+    # Ring buffer of the GPIO transitions captured by GpioMonitor
+    COLUMNS = [('pin', 'b'), ('level', 'b'), ('time', 'd')]
+
+class GpioMonitor:
+    # Edge-triggered capture of the input pins. Every transition is timestamped in
+    # the GPIO callback and stored in a GpioEvents ring buffer with a sequence
+    # number, so pulses shorter than any polling interval are not lost.
+    def __init__(self, pins=GPIO_EVENT_PINS, bounce_time=GPIO_BOUNCE_TIME, capacity=GPIO_EVENT_CAPACITY):
+        self.pins = pins
+        self.bounce_time = bounce_time  # ms
+        self.events = GpioEvents(capacity)
+        self.levels = {}  # Level of each pin after its last event
+        self.last_time = dict.fromkeys(pins, 0.0)  # Time of the last event per pin
+        self.rising = dict.fromkeys(pins, 0)  # Rising edges per pin
+        self.falling = dict.fromkeys(pins, 0)  # Falling edges per pin
+        self.bounces = dict.fromkeys(pins, 0)  # Edges dropped by the debounce per pin
+        self.seq = 0
+        self.lock = Lock()
+
+    def start(self):
+        # Read the current levels and register the edge callbacks
+        for pin in self.pins:
+            self.levels[pin] = GPIO.input(pin)
+            GPIO.add_event_detect(pin, GPIO.BOTH, callback=self.on_edge, bouncetime=self.bounce_time)
+
+    def stop(self):
+        for pin in self.pins:
+            GPIO.remove_event_detect(pin)
+
+    def on_edge(self, pin):
+        # GPIO callback: record the new level of pin. A level equal to the last one
+        # is contact bounce within bounce_time, otherwise a pulse that ended before
+        # the callback ran, which is recorded as both of its edges.
+        now = time.time()
+        level = GPIO.input(pin)
+        with self.lock:
+            if level == self.levels[pin]:
+                if now - self.last_time[pin] < self.bounce_time / 1000:
+                    self.bounces[pin] += 1
+                    return
+                self.record(pin, 1 - level, now)
+            self.record(pin, level, now)
+
+    def record(self, pin, level, now):
+        # Store one transition, the caller holds the lock
+        self.seq += 1
+        self.levels[pin] = level
+        self.last_time[pin] = now
+        if level:
+            self.rising[pin] += 1
+        else:
+            self.falling[pin] += 1
+        self.events.append(GpioEvent(pin, level, now, self.seq))
+
+    def counts(self):
+        # Edge counters per pin
+        with self.lock:
+            return {str(pin): {'level': self.levels.get(pin), 'rising': self.rising[pin],
+                               'falling': self.falling[pin], 'bounces': self.bounces[pin]}
+                    for pin in self.pins}
+
+    def version(self):
+        # Changes with every recorded or dropped edge, for the response cache
+        with self.lock:
+            return self.seq, sum(self.bounces.values())
+
+    def to_json(self, since=None, limit=None):
+        # The events in the ?q=history format (since / limit, "seq" cursor) plus the per-pin counters
+        events = self.events.to_json(since, limit)
+        return events[:-1] + (', "counts": %s}' % json.dumps(self.counts())).encode('utf-8')
+
+def json_name(name):
+    # Key of a history column in the JSON responses
+    return 'date_time' if name == 'timestamp' else name
+
+def json_items(name, typecode, values):
+    # Format the values of one history column as JSON list items
+    if name == 'timestamp':
+        return ['"%s"' % datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S') for t in values]
+    if typecode == 'd':
+        return ['null' if v != v else repr(v) for v in values]  # NaN: not measured yet
+    if typecode == 'i':
+        return ['null' if v < 0 else str(v) for v in values]
+    return [str(v) for v in values]
+
+def parse_time(value):
+    # Parse a from/to query value, either epoch seconds or 'YYYY-MM-DD HH:MM:SS'
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+class SampleLog:
+    # Append-only file of fixed-size binary records, one per sample, with the
+    # HistoryBuffer columns. A sparse in-memory index of every LOG_INDEX_STRIDE-th
+    # timestamp lets range queries binary-search the file, and the matching
+    # records are read through a memory map instead of being loaded into RAM.
+    RECORD = struct.Struct('<' + ''.join(typecode for name, typecode in HistoryBuffer.COLUMNS))
+    TIMESTAMP = [name for name, typecode in HistoryBuffer.COLUMNS].index('timestamp')
+    CHUNK = 4096  # Records formatted per write when streaming
+
+    def __init__(self, path=HISTORY_LOG, sync_interval=LOG_SYNC_INTERVAL, index_stride=LOG_INDEX_STRIDE,
+                 buffering=-1):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.index_stride = index_stride
+        self.lock = Lock()
+        # Unbuffered (0) when other processes read the file, see SampleLogReader
+        self.file = open(path, 'ab', buffering=buffering)
+        size = self.file.tell()
+        if size % self.RECORD.size:
+            # Drop a partial record left by a crash
+            size -= size % self.RECORD.size
+            self.file.truncate(size)
+            self.file.seek(size)
+        self.count = size // self.RECORD.size  # Number of records in the file
+        self.index = array('d')  # Timestamp of every index_stride-th record
+        self.build_index()
+        self.stopped = Event()
+        self.sync_thread = Thread(target=self.sync_loop)
+        self.sync_thread.daemon = True
+        self.sync_thread.start()
+
+    def build_index(self):
+        # Read the timestamp of every index_stride-th record of an existing file
+        if not self.count:
+            return
+        with open(self.path, 'rb') as file:
+            with mmap.mmap(file.fileno(), self.count * self.RECORD.size, access=mmap.ACCESS_READ) as mm:
+                for n in range(0, self.count, self.index_stride):
+                    self.index.append(self.timestamp_at(mm, n))
+
+    def timestamp_at(self, mm, n):
+        return self.RECORD.unpack_from(mm, n * self.RECORD.size)[self.TIMESTAMP]
+
+    def append(self, snapshot):
+        # Append one snapshot, the data reaches the disk at the next sync
+        values = []
+        for name, typecode in HistoryBuffer.COLUMNS:
+            value = getattr(snapshot, name)
+            values.append(HistoryBuffer.MISSING.get(typecode, -1) if value is None else value)
+        record = self.RECORD.pack(*values)
+        with self.lock:
+            if self.count % self.index_stride == 0:
+                self.index.append(snapshot.timestamp)
+            self.file.write(record)
+            self.count += 1
+
+    def sync_loop(self):
+        # Flush and fsync the log every sync_interval seconds
+        while not self.stopped.wait(self.sync_interval):
+            self.sync()
+
+    def sync(self):
+        with self.lock:
+            self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.stopped.set()
+        self.sync_thread.join()
+        self.sync()
+        self.file.close()
+
+    def find(self, mm, index, count, timestamp):
+        # Return the number of the first record at or after timestamp
+        block = max(bisect_left(index, timestamp) - 1, 0)
+        n = block * self.index_stride
+        end = min(n + 2 * self.index_stride, count)
+        while n < end and self.timestamp_at(mm, n) < timestamp:
+            n += 1
+        return n
+
+    def state(self):
+        # Number of records readable from the file and a copy of the index
+        with self.lock:
+            self.file.flush()
+            return self.count, self.index[:]
+
+    def write_json(self, wfile, start=None, end=None, limit=None):
+        # Stream the records with start <= timestamp < end to wfile in the ?q=history
+        # format, with limit only the newest ones of the range
+        count, index = self.state()
+        if not count:
+            wfile.write(('{' + ', '.join('"%s": []' % json_name(name) for name, typecode in HistoryBuffer.COLUMNS) + '}').encode('utf-8'))
+            return
+        size = self.RECORD.size
+        with open(self.path, 'rb') as file:
+            with mmap.mmap(file.fileno(), count * size, access=mmap.ACCESS_READ) as mm:
+                first = 0 if start is None else self.find(mm, index, count, start)
+                last = count if end is None else max(self.find(mm, index, count, end), first)
+                if limit is not None:
+                    first = max(first, last - limit)
+                with memoryview(mm) as view:
+                    for column, (name, typecode) in enumerate(HistoryBuffer.COLUMNS):
+                        wfile.write(('%s"%s": [' % ('{' if column == 0 else ', ', json_name(name))).encode('utf-8'))
+                        for lo in range(first, last, self.CHUNK):
+                            hi = min(lo + self.CHUNK, last)
+                            values = [record[column] for record in self.RECORD.iter_unpack(view[lo * size:hi * size])]
+                            items = ', '.join(json_items(name, typecode, values))
+                            wfile.write(((', ' if lo > first else '') + items).encode('utf-8'))
+                        wfile.write(b']')
+                wfile.write(b'}')
+
+class SampleLogReader(SampleLog):
+    # Read-only SampleLog of a file appended to by another process, for the HTTP
+    # worker processes. The records added since the last query are indexed when
+    # the next query needs them.
+    def __init__(self, path=HISTORY_LOG, index_stride=LOG_INDEX_STRIDE):
+        self.path = path
+        self.index_stride = index_stride
+        self.lock = Lock()
+        self.count = 0
+        self.index = array('d')
+
+    def state(self):
+        with self.lock:
+            try:
+                count = os.path.getsize(self.path) // self.RECORD.size
+            except FileNotFoundError:
+                count = 0  # The sampler process has not created it yet
+            if count > self.count:
+                with open(self.path, 'rb') as file:
+                    with mmap.mmap(file.fileno(), count * self.RECORD.size, access=mmap.ACCESS_READ) as mm:
+                        for n in range(len(self.index) * self.index_stride, count, self.index_stride):
+                            self.index.append(self.timestamp_at(mm, n))
+                self.count = count
+            return self.count, self.index[:]
+
+    def close(self):
+        pass
+
+class RollupLevel(HistoryBuffer):
+    # Ring buffer of fixed-width time buckets holding count, sum, min and max of
+    # every analog channel. Buckets are updated in place as samples arrive.
+    CHANNELS = ['temperature', 'pressure', 'co2']
+    COLUMNS = [('timestamp', 'd')] + [(channel + suffix, typecode) for channel in CHANNELS
+                                      for suffix, typecode in [('_count', 'l'), ('_sum', 'd'), ('_min', 'd'), ('_max', 'd')]]
+
+    def __init__(self, resolution, capacity):
+        HistoryBuffer.__init__(self, capacity)
+        self.resolution = resolution  # Seconds per bucket
+
+    def append(self, snapshot):
+        # Add one sample to its bucket, opening a new bucket when the time moves past the last one
+        bucket = snapshot.timestamp // self.resolution * self.resolution
+        with self.lock:
+            last = (self.start + self.count - 1) % self.capacity
+            if self.count == 0 or bucket > self.columns['timestamp'][last]:
+                if self.count < self.capacity:
+                    last = (self.start + self.count) % self.capacity
+                    self.count += 1
+                else:
+                    last = self.start
+                    self.start = (self.start + 1) % self.capacity
+                self.columns['timestamp'][last] = bucket
+                for channel in self.CHANNELS:
+                    self.columns[channel + '_count'][last] = 0
+                    self.columns[channel + '_sum'][last] = 0.0
+                    self.columns[channel + '_min'][last] = math.inf
+                    self.columns[channel + '_max'][last] = -math.inf
+            elif bucket < self.columns['timestamp'][last]:
+                return  # The clock stepped backwards, keep the buckets ordered
+            for channel in self.CHANNELS:
+                value = getattr(snapshot, channel)
+                if value is None or value != value:
+                    continue
+                self.columns[channel + '_count'][last] += 1
+                self.columns[channel + '_sum'][last] += value
+                if value < self.columns[channel + '_min'][last]:
+                    self.columns[channel + '_min'][last] = value
+                if value > self.columns[channel + '_max'][last]:
+                    self.columns[channel + '_max'][last] = value
+
+    def buckets(self, start, end):
+        # Return {column: array} of the buckets overlapping start - end, oldest first
+        columns = self.read(lambda: {name: self.ordered(name) for name, typecode in self.COLUMNS})
+        first = bisect_left(columns['timestamp'], start // self.resolution * self.resolution)
+        last = bisect_left(columns['timestamp'], end)
+        return {name: values[first:last] for name, values in columns.items()}
+
+class Rollups:
+    # Multi-resolution summaries of the samples, maintained incrementally, used to
+    # answer ?q=history&points=N over any range at a cost bound by N.
+    AGGREGATES = ['mean', 'min', 'max', 'lttb']
+
+    def __init__(self, history, levels=ROLLUP_LEVELS, sample_interval=SAMPLE_INTERVAL, level_class=None):
+        self.history = history  # Raw samples, the finest level
+        self.sample_interval = sample_interval
+        self.levels = [(level_class or RollupLevel)(resolution, capacity) for resolution, capacity in levels]
+
+    def append(self, snapshot):
+        for level in self.levels:
+            level.append(snapshot)
+
+    def oldest(self):
+        # Timestamp of the oldest data: the oldest raw sample, or the oldest bucket of a
+        # level reaching further back. Read from the buffers, so HTTP workers agree.
+        oldest = self.history.oldest()
+        for level in self.levels:
+            bucket = level.oldest()
+            if bucket is not None and (oldest is None or bucket + level.resolution <= oldest):
+                oldest = bucket
+        return oldest
+
+    def raw_buckets(self, start, end):
+        # Present the raw samples as one-sample buckets
+        columns = self.history.read(lambda: {name: self.history.ordered(name)
+                                             for name in ['timestamp'] + RollupLevel.CHANNELS})
+        timestamps = columns['timestamp']
+        first = bisect_left(timestamps, start)
+        last = bisect_left(timestamps, end)
+        columns['timestamp'] = timestamps[first:last]
+        for channel in RollupLevel.CHANNELS:
+            values = columns[channel][first:last]
+            if values.typecode == 'i':
+                values = array('d', [math.nan if v < 0 else v for v in values])
+            counts = array('l', [0 if v != v else 1 for v in values])
+            del columns[channel]
+            columns[channel + '_count'] = counts
+            columns[channel + '_sum'] = values
+            columns[channel + '_min'] = values
+            columns[channel + '_max'] = values
+        return columns
+
+    def select(self, start, end, points):
+        # Pick the finest level that covers start and has few enough buckets in the range
+        budget = points * ROLLUP_OVERSAMPLE
+        history_start = self.history.oldest()
+        if history_start is not None and history_start <= start + self.sample_interval and (end - start) / self.sample_interval <= budget:
+            return self.sample_interval, self.raw_buckets(start, end)
+        for level in self.levels:
+            oldest = level.oldest()
+            if oldest is not None and oldest <= start + level.resolution and (end - start) / level.resolution <= budget:
+                return level.resolution, level.buckets(start, end)
+        level = self.levels[-1]
+        return level.resolution, level.buckets(start, end)
+
+    def query(self, start, end, points, agg='mean'):
+        # Return the downsampled series of every channel between start and end
+        oldest = self.oldest() or 0.0
+        start = oldest if start is None else max(start, oldest)  # The output buckets start at the data
+        if end is None:
+            end = time.time() + 1
+        resolution, buckets = self.select(start, end, points)
+        data = {'agg': agg, 'points': points, 'resolution': resolution}
+        for channel in RollupLevel.CHANNELS:
+            if agg == 'lttb':
+                series = self.series(buckets, channel, 'mean')
+                series = lttb(series, points)
+            else:
+                series = self.merge(buckets, channel, agg, start, end, points)
+            data[channel] = {
+                'date_time': [datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S') for t, v in series],
+                'values': [v for t, v in series]
+            }
+        return data
+
+    def series(self, buckets, channel, agg):
+        # (timestamp, value) of every non-empty bucket
+        counts = buckets[channel + '_count']
+        if agg == 'mean':
+            values = [total / count if count else None for total, count in zip(buckets[channel + '_sum'], counts)]
+        else:
+            values = buckets[channel + '_' + agg]
+        return [(t, v) for t, v, count in zip(buckets['timestamp'], values, counts) if count]
+
+    def merge(self, buckets, channel, agg, start, end, points):
+        # Merge the buckets into points equal-width output buckets
+        width = (end - start) / points
+        counts = [0] * points
+        totals = [0.0] * points
+        lows = [math.inf] * points
+        highs = [-math.inf] * points
+        for t, count, total, low, high in zip(buckets['timestamp'], buckets[channel + '_count'],
+                                              buckets[channel + '_sum'], buckets[channel + '_min'],
+                                              buckets[channel + '_max']):
+            if not count:
+                continue
+            n = min(max(int((t - start) / width), 0), points - 1)
+            counts[n] += count
+            totals[n] += total
+            lows[n] = min(lows[n], low)
+            highs[n] = max(highs[n], high)
+        result = {'mean': [total / count if count else None for total, count in zip(totals, counts)],
+                  'min': lows, 'max': highs}[agg]
+        return [(start + n * width, result[n]) for n in range(points) if counts[n]]
+
+def lttb(series, points):
+    # Largest-Triangle-Three-Buckets downsampling of (x, y) pairs to at most points pairs
+    if points >= len(series):
+        return list(series)
+    if points < 3:
+        return [series[0], series[-1]][-points:]
+    sampled = [series[0]]
+    every = (len(series) - 2) / (points - 2)
+    a = 0
+    for i in range(points - 2):
+        # Average of the next bucket, the third point of the triangle
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, len(series))
+        next_bucket = series[next_start:next_end]
+        avg_x = sum(x for x, y in next_bucket) / len(next_bucket)
+        avg_y = sum(y for x, y in next_bucket) / len(next_bucket)
+        # Pick the point of this bucket forming the largest triangle with a and the average
+        ax, ay = series[a]
+        best = -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            x, y = series[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best:
+                best = area
+                choice = j
+        sampled.append(series[choice])
+        a = choice
+    sampled.append(series[-1])
+    return sampled
+
+class RollingWindow:
+    # Statistics of one channel over the last `seconds` seconds, updated in O(1)
+    # amortized per sample: Welford mean and variance with removal, monotonic
+    # deques for min and max and running sums for the least-squares slope. The
+    # sums are recomputed from the window after as many removals as it holds
+    # values, which bounds the rounding error of the removals.
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.values = deque()  # (timestamp, value), oldest first
+        self.lows = deque()  # Increasing values after each other, the first is the minimum
+        self.highs = deque()  # Decreasing values after each other, the first is the maximum
+        self.recompute()
+
+    def recompute(self):
+        # Rebuild the running sums, relative to the oldest sample
+        self.t0, self.v0 = self.values[0] if self.values else (0.0, 0.0)
+        self.mean = self.m2 = 0.0
+        self.sx = self.sxx = self.sy = self.sxy = 0.0
+        self.removed = 0
+        for n, (timestamp, value) in enumerate(self.values):
+            self.add(timestamp, value, n + 1)
+
+    def add(self, timestamp, value, n):
+        # Add one sample to the sums, n is the count including it
+        delta = value - self.mean
+        self.mean += delta / n
+        self.m2 += delta * (value - self.mean)
+        x, y = timestamp - self.t0, value - self.v0
+        self.sx += x
+        self.sxx += x * x
+        self.sy += y
+        self.sxy += x * y
+
+    def append(self, timestamp, value):
+        # Add the newest sample and drop the samples older than seconds before it
+        if not self.values:
+            self.t0, self.v0 = timestamp, value  # The sums are empty, start them at this sample
+        self.values.append((timestamp, value))
+        self.add(timestamp, value, len(self.values))
+        while self.lows and self.lows[-1][1] >= value:
+            self.lows.pop()
+        self.lows.append((timestamp, value))
+        while self.highs and self.highs[-1][1] <= value:
+            self.highs.pop()
+        self.highs.append((timestamp, value))
+        start = timestamp - self.seconds
+        while self.values[0][0] <= start:
+            old_timestamp, old_value = self.values.popleft()
+            n = len(self.values)
+            delta = old_value - self.mean
+            self.mean -= delta / n
+            self.m2 -= delta * (old_value - self.mean)
+            x, y = old_timestamp - self.t0, old_value - self.v0
+            self.sx -= x
+            self.sxx -= x * x
+            self.sy -= y
+            self.sxy -= x * y
+            self.removed += 1
+        while self.lows[0][0] <= start:
+            self.lows.popleft()
+        while self.highs[0][0] <= start:
+            self.highs.popleft()
+        if self.removed >= len(self.values):
+            self.recompute()
+
+    def stats(self):
+        # count, mean, stddev, min, max and the slope of the values per minute
+        n = len(self.values)
+        if not n:
+            return {'count': 0, 'mean': None, 'stddev': None, 'min': None, 'max': None, 'rate_per_minute': None}
+        spread = n * self.sxx - self.sx * self.sx
+        return {'count': n,
+                'mean': self.mean,
+                'stddev': math.sqrt(max(self.m2, 0.0) / (n - 1)) if n > 1 else 0.0,
+                'min': self.lows[0][1],
+                'max': self.highs[0][1],
+                'rate_per_minute': 60 * (n * self.sxy - self.sx * self.sy) / spread if spread > 0 else None}
+
+class RollingStats:
+    # Rolling statistics of the analog channels over each of the STATS_WINDOWS, fed
+    # with the channels measured for each snapshot (see SensorSampler.add_listener),
+    # so a value kept over from an earlier measurement is not counted again. The
+    # windows end at the newest sample.
+    def __init__(self, windows=STATS_WINDOWS):
+        self.windows = dict(windows)  # Name -> seconds
+        self.channels = {name: {channel: RollingWindow(seconds) for channel in RollupLevel.CHANNELS}
+                         for name, seconds in windows}
+        self.seq = 0  # Sequence number of the newest sample
+        self.date_time = None
+        self.lock = Lock()
+
+    def append(self, snapshot, channels=RollupLevel.CHANNELS):
+        with self.lock:
+            for channel in channels:
+                value = getattr(snapshot, channel)
+                if value is None or value != value:
+                    continue
+                for windows in self.channels.values():
+                    windows[channel].append(snapshot.timestamp, value)
+            self.seq = snapshot.seq
+            self.date_time = snapshot.date_time
+
+    def to_dict(self, names):
+        # The statistics of the named windows in the ?q=stats format
+        with self.lock:
+            data = {}
+            for name in names:
+                data[name] = {'seconds': self.windows[name]}
+                for channel, window in self.channels[name].items():
+                    data[name][channel] = window.stats()
+            data['date_time'] = self.date_time
+            data['seq'] = self.seq
+            return data
+
+def header_field(index):
+    # Property kept in slot index of the header of a SharedBuffer
+    return property(lambda self: self.header[index],
+                    lambda self, value: self.header.__setitem__(index, value))
+
+class SharedBuffer:
+    # Mixin keeping the columns and the ring position of a HistoryBuffer subclass in
+    # one multiprocessing.shared_memory block. The sampler process appends, and the
+    # HTTP worker processes, forked after the block was created, read it in place.
+    # The block is guarded by a seqlock: appends make the sequence odd while they
+    # write, and read() runs a reader again when the sequence was odd or changed.
+    sequence = header_field(0)
+    start = header_field(1)
+    count = header_field(2)
+    last_seq = header_field(3)
+    HEADER_SLOTS = 4
+
+    def __init__(self, *args, **kwargs):
+        self.writer = Lock()  # Serializes the appends of the owning process
+        super().__init__(*args, **kwargs)
+
+    def create_columns(self):
+        # Lay the header and the columns out in the block, each 8-byte aligned.
+        # The block is removed when the process that created it exits.
+        sizes = [(array(typecode).itemsize * self.capacity + 7) // 8 * 8 for name, typecode in self.COLUMNS]
+        offset = 8 * self.HEADER_SLOTS
+        self.memory = shared_memory.SharedMemory(create=True, size=offset + sum(sizes))
+        atexit.register(self.close)
+        self.header = self.memory.buf[:offset].cast('q')
+        columns = {}
+        for (name, typecode), size in zip(self.COLUMNS, sizes):
+            columns[name] = self.memory.buf[offset:offset + size].cast(typecode)[:self.capacity]
+            offset += size
+        return columns
+
+    def read(self, method, *args):
+        # Call method without a lock, again until no append overlapped it
+        while True:
+            sequence = self.sequence
+            if not sequence & 1:
+                try:
+                    result = method(*args)
+                except Exception:
+                    if self.sequence == sequence:
+                        raise
+                    continue  # Torn read of a half-written sample
+                if self.sequence == sequence:
+                    return result
+            time.sleep(0)
+
+    def append(self, item):
+        with self.writer:
+            if self.memory is None:
+                return  # Closed at exit
+            self.sequence += 1
+            try:
+                super().append(item)
+            finally:
+                self.sequence += 1
+
+    def close(self):
+        # Release the views and remove the block
+        with self.writer:
+            for view in [self.header] + list(self.columns.values()):
+                view.release()
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+
+class SharedHistoryBuffer(SharedBuffer, HistoryBuffer):
+    # HistoryBuffer in shared memory, the HTTP workers also take their latest
+    # snapshot from its newest sample
+    def snapshots(self, since=None):
+        # Snapshots of the samples after sequence number since, oldest first, or of the newest sample
+        return self.read(self.rows, since)
+
+    def rows(self, since):
+        # Rebuild the snapshots from the columns, inside read()
+        if not self.count:
+            return []
+        last_seq = self.last_seq
+        count = 1 if since is None else max(min(last_seq - since, self.count), 0)
+        snapshots = []
+        for n in range(count):
+            index = (self.start + self.count - count + n) % self.capacity
+            values = {}
+            for name, typecode in self.COLUMNS:
+                value = self.columns[name][index]
+                values[name] = None if value != value or (typecode == 'i' and value < 0) else value
+            timestamp = values['timestamp']
+            snapshots.append(Snapshot(date_time=datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S'),
+                                      seq=last_seq - count + 1 + n, **values))
+        return snapshots
+
+class SharedPressureTrace(SharedBuffer, PressureTrace):
+    pass
+
+class SharedRollupLevel(SharedBuffer, RollupLevel):
+    pass
+
+def snapshot_data(snapshot):
+    # JSON-ready dict of a snapshot, as returned by ?q=all
+    return {
+            'temperature': snapshot.temperature,
+            'pressure': snapshot.pressure,
+            'co2': snapshot.co2,
+            'gpio35': snapshot.gpio35,
+            'gpio36': snapshot.gpio36,
+            'gpio27': snapshot.gpio27,
+            'gpio29': snapshot.gpio29,
+            'gpio31': snapshot.gpio31,
+            'gpio33': snapshot.gpio33,
+            'date_time': snapshot.date_time,
+            'seq': snapshot.seq
+    }
+
+class Broadcaster:
+    # Fans every published snapshot out to the ?q=stream clients. Each event is
+    # serialized once and put on a bounded queue per client; a slow client loses
+    # its oldest events instead of holding up the sampler or the other clients.
+    def __init__(self, queue_size=STREAM_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.lock = Lock()
+        self.dropped = 0  # Events dropped for slow clients
+
+    def subscribe(self):
+        # Return a new queue that receives every following event
+        events = queue.Queue(self.queue_size)
+        with self.lock:
+            self.subscribers.add(events)
+        return events
+
+    def unsubscribe(self, events):
+        with self.lock:
+            self.subscribers.discard(events)
+
+    def publish(self, snapshot):
+        # Queue the snapshot as a Server-Sent Event for every client
+        event = ('id: %d\ndata: %s\n\n' % (snapshot.seq, json.dumps(snapshot_data(snapshot)))).encode('utf-8')
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for events in subscribers:
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                try:
+                    events.get_nowait()
+                except queue.Empty:
+                    pass
+                self.dropped += 1
+                try:
+                    events.put_nowait(event)
+                except queue.Full:
+                    pass
+
+class Uplink:
+    # Pushes every sample to a central collector, for boards behind NAT. Samples are
+    # batched (batch_size samples or max_delay seconds), gzip-compressed and POSTed
+    # over one kept-alive connection by a sender thread. Batches the collector does
+    # not take go to a bounded spool directory, which survives restarts, and are
+    # replayed oldest first with exponential backoff between failed attempts.
+    def __init__(self, url, batch_size=UPLINK_BATCH_SIZE, max_delay=UPLINK_MAX_DELAY, timeout=UPLINK_TIMEOUT,
+                 spool=UPLINK_SPOOL, spool_max_bytes=UPLINK_SPOOL_MAX_BYTES, backoff=UPLINK_BACKOFF,
+                 queue_size=UPLINK_QUEUE_SIZE):
+        parsed = urlparse(url)
+        self.connection_class = HTTPSConnection if parsed.scheme == 'https' else HTTPConnection
+        self.address = (parsed.hostname, parsed.port)
+        self.path = (parsed.path or '/') + ('?' + parsed.query if parsed.query else '')
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.spool = spool
+        self.spool_max_bytes = spool_max_bytes
+        self.backoff = backoff
+        self.samples = queue.Queue(queue_size)
+        self.source = socket.gethostname()
+        self.connection = None
+        self.failures = 0  # Failed attempts since the last delivery
+        self.retry_time = 0.0  # Monotonic time of the next attempt after a failure
+        self.spooled = deque()  # (file name, samples) of the spooled batches, oldest first
+        self.spool_bytes = 0
+        self.next_id = 0
+        if spool:
+            os.makedirs(spool, exist_ok=True)
+            for name in sorted(os.listdir(spool)):
+                path = os.path.join(spool, name)
+                batch_id, _, count = name.split('.')[0].partition('-')
+                if not (batch_id.isdigit() and count.isdigit() and name.endswith(('.json.gz', '.json.gz.tmp'))):
+                    log(f"Uplink: ignoring {path}, not a spooled batch")
+                    continue
+                if name.endswith('.tmp'):
+                    os.remove(path)  # Left by a crash while spooling
+                    continue
+                self.spooled.append((name, int(count)))
+                self.spool_bytes += os.path.getsize(path)
+                self.next_id = int(batch_id) + 1
+        # Counters for ?q=metrics
+        self.sent_batches = 0
+        self.sent_samples = 0
+        self.rejected_batches = 0
+        self.failed_posts = 0
+        self.dropped = {'queue': 0, 'spool': 0}  # Samples dropped per reason
+        self.post_seconds = Histogram()
+        self.stopped = Event()
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def append(self, snapshot):
+        # Queue one sample for the sender, never blocks the sampler
+        try:
+            self.samples.put_nowait(snapshot)
+        except queue.Full:
+            self.dropped['queue'] += 1
+
+    def run(self):
+        # Send the batches, spooling them while the collector is unreachable or
+        # older batches wait in the spool, and replay the spool when allowed
+        while not self.stopped.is_set():
+            batch = self.collect()
+            if batch:
+                body = self.encode(batch)
+                if self.spooled or time.monotonic() < self.retry_time or not self.send(body, len(batch)):
+                    self.store(body, len(batch))
+            self.replay()
+
+    def collect(self):
+        # Wait up to a second for a sample, then up to max_delay for the batch to fill,
+        # checking every second whether stop() was called
+        try:
+            batch = [self.samples.get(timeout=1.0)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.batch_size and not self.stopped.is_set():
+            try:
+                batch.append(self.samples.get(timeout=min(max(deadline - time.monotonic(), 0), 1.0)))
+            except queue.Empty:
+                if time.monotonic() >= deadline:
+                    break
+        return batch
+
+    def encode(self, batch):
+        # Gzip-compressed JSON with one list per snapshot field, like ?q=history
+        data = {'source': self.source}
+        for field in Snapshot._fields:
+            data[field] = [getattr(snapshot, field) for snapshot in batch]
+        return gzip.compress(json.dumps(data).encode('utf-8'), compresslevel=6)
+
+    def send(self, body, count):
+        # POST one batch, True when the collector took it or rejected it for good.
+        # A kept-alive connection the collector has closed is retried once on a new one.
+        for attempt in range(2):
+            reused = self.connection is not None
+            if not reused:
+                self.connection = self.connection_class(*self.address, timeout=self.timeout)
+            start = time.perf_counter()
+            try:
+                self.connection.request('POST', self.path, body, {'Content-Type': 'application/json',
+                                                                  'Content-Encoding': 'gzip'})
+                response = self.connection.getresponse()
+                response.read()
+            except (OSError, HTTPException) as e:
+                self.connection.close()
+                self.connection = None
+                if reused and attempt == 0:
+                    continue
+                return self.failed(str(e))
+            self.post_seconds.observe(time.perf_counter() - start)
+            if 200 <= response.status < 300:
+                self.failures = 0
+                self.sent_batches += 1
+                self.sent_samples += count
+                return True
+            if 400 <= response.status < 500 and response.status not in (408, 429):
+                log(f"Uplink: collector rejected a batch of {count} samples: HTTP {response.status}")
+                self.rejected_batches += 1
+                return True
+            return self.failed('HTTP %d' % response.status)
+
+    def failed(self, reason):
+        # Schedule the next attempt after an exponentially growing, jittered delay
+        self.failed_posts += 1
+        self.failures += 1
+        delay = min(self.backoff[0] * 2 ** (self.failures - 1), self.backoff[1])
+        self.retry_time = time.monotonic() + delay * random.uniform(0.5, 1.0)
+        if self.failures == 1:
+            log(f"Uplink: collector unreachable ({reason}), spooling")
+        return False
+
+    def store(self, body, count):
+        # Add a batch to the spool, dropping the oldest batches beyond spool_max_bytes
+        if not self.spool:
+            self.dropped['spool'] += count
+            return
+        name = '%012d-%d.json.gz' % (self.next_id, count)
+        self.next_id += 1
+        path = os.path.join(self.spool, name)
+        with open(path + '.tmp', 'wb') as file:
+            file.write(body)
+        os.replace(path + '.tmp', path)
+        self.spooled.append((name, count))
+        self.spool_bytes += len(body)
+        while self.spool_bytes > self.spool_max_bytes and len(self.spooled) > 1:
+            name, count = self.spooled.popleft()
+            path = os.path.join(self.spool, name)
+            self.spool_bytes -= os.path.getsize(path)
+            os.remove(path)
+            self.dropped['spool'] += count
+
+    def replay(self):
+        # Send the spooled batches oldest first until one fails or the spool is empty
+        while self.spooled and time.monotonic() >= self.retry_time and not self.stopped.is_set():
+            name, count = self.spooled[0]
+            path = os.path.join(self.spool, name)
+            with open(path, 'rb') as file:
+                body = file.read()
+            if not self.send(body, count):
+                return
+            self.spooled.popleft()
+            self.spool_bytes -= len(body)
+            os.remove(path)
+
+    def stop(self):
+        # Stop the sender and spool the samples still queued
+        self.stopped.set()
+        self.thread.join()
+        batch = []
+        try:
+            while True:
+                batch.append(self.samples.get_nowait())
+        except queue.Empty:
+            pass
+        for n in range(0, len(batch), self.batch_size):
+            chunk = batch[n:n + self.batch_size]
+            self.store(self.encode(chunk), len(chunk))
+        if self.connection:
+            self.connection.close()
+
+    def metrics(self):
+        # Prometheus lines of the deliveries, the spool and the POST durations
+        lines = ['# TYPE sensor_uplink_batches_total counter',
+                 'sensor_uplink_batches_total{result="sent"} %d' % self.sent_batches,
+                 'sensor_uplink_batches_total{result="rejected"} %d' % self.rejected_batches,
+                 '# TYPE sensor_uplink_samples_sent_total counter',
+                 'sensor_uplink_samples_sent_total %d' % self.sent_samples,
+                 '# TYPE sensor_uplink_failed_posts_total counter',
+                 'sensor_uplink_failed_posts_total %d' % self.failed_posts,
+                 '# TYPE sensor_uplink_dropped_samples_total counter']
+        for reason, count in self.dropped.items():
+            lines.append('sensor_uplink_dropped_samples_total{reason="%s"} %d' % (reason, count))
+        lines += ['# TYPE sensor_uplink_spool_batches gauge',
+                  'sensor_uplink_spool_batches %d' % len(self.spooled),
+                  '# TYPE sensor_uplink_spool_bytes gauge',
+                  'sensor_uplink_spool_bytes %d' % self.spool_bytes,
+                  '# TYPE sensor_uplink_post_seconds histogram']
+        lines += self.post_seconds.render('sensor_uplink_post_seconds')
+        return lines
+
+class CachedResponse:
+    # A response body serialized once, with its ETag and a gzip copy made on first use
+    def __init__(self, body, content_type, last_modified=None):
+        self.body = body
+        self.content_type = content_type
+        self.etag = '"%s"' % hashlib.md5(body).hexdigest()
+        self.last_modified = formatdate(last_modified, usegmt=True) if last_modified else None
+        self.compressed = None
+        self.header_blocks = {}  # Prebuilt header blocks by (status, gzip)
+
+    def gzipped(self):
+        # Compress the body once, every later request shares the result
+        if self.compressed is None:
+            self.compressed = gzip.compress(self.body, compresslevel=6)
+        return self.compressed
+
+    def etag_for(self, compress):
+        return self.etag[:-1] + '-gzip"' if compress else self.etag
+
+    def headers(self, status, compress):
+        # Header block of a 200 or 304 response, built once per variant
+        block = self.header_blocks.get((status, compress))
+        if block is None:
+            lines = ['ETag: %s' % self.etag_for(compress)]
+            if status == 200:
+                body = self.gzipped() if compress else self.body
+                lines += ['Content-Type: %s' % self.content_type, 'Content-Length: %d' % len(body),
+                          'Cache-Control: no-cache', 'Vary: Accept-Encoding']
+                if self.last_modified:
+                    lines.append('Last-Modified: %s' % self.last_modified)
+                if compress:
+                    lines.append('Content-Encoding: gzip')
+            block = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+            self.header_blocks[(status, compress)] = block
+        return block
+
+class ResponseCache:
+    # Serialized responses by key, rebuilt only when the version of their data
+    # changes (a new sample, a modified file)
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.lock = Lock()
+
+    def get(self, key, version, build):
+        # Return the response for key, calling build() if it is missing or out of date
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry and entry[0] == version:
+            return entry[1]
+        response = build()
+        with self.lock:
+            if key not in self.entries and len(self.entries) >= self.max_entries:
+                del self.entries[next(iter(self.entries))]
+            self.entries[key] = (version, response)
+        return response
+
+class ChunkedWriter:
+    # File-like wrapper sending every write as one HTTP/1.1 chunk, for bodies
+    # whose length is not known up front
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, data):
+        if data:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+    def close(self):
+        self.wfile.write(b'0\r\n\r\n')
+
+def json_response(data):
+    # Build a CachedResponse holding data as JSON
+    return CachedResponse(json.dumps(data).encode('utf-8'), 'application/json')
+
+class LogPipeline:
+    # Request log lines and server messages are queued in O(1) and written to stdout
+    # and the optional rotating log file in batches by one consumer thread. The
+    # Tk window takes its own batches on the Tk thread, see WebUI.attach_log().
+    def __init__(self, path=LOG_FILE, max_bytes=LOG_FILE_MAX_BYTES, backups=LOG_FILE_BACKUPS,
+                 queue_size=LOG_QUEUE_SIZE, flush_interval=LOG_FLUSH_INTERVAL, records=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        # A multiprocessing queue also collects the lines of the HTTP worker processes
+        self.records = records if records is not None else queue.Queue(queue_size)
+        self.dropped = 0  # Lines dropped because the queue was full
+        self.ui_lines = None  # Lines waiting for the Tk window, once one is attached
+        self.file = open(path, 'a') if path else None
+        self.stopped = Event()
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def log(self, message):
+        # Queue one line, never blocks the caller
+        try:
+            self.records.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def attach_ui(self, max_lines=LOG_UI_LINES):
+        # Keep the newest lines for the Tk window, which removes them with take_ui_lines()
+        self.ui_lines = deque(maxlen=max_lines)
+
+    def take_ui_lines(self):
+        # Remove and return the lines queued for the Tk window
+        lines = []
+        while self.ui_lines:
+            lines.append(self.ui_lines.popleft())
+        return lines
+
+    def run(self):
+        # Write everything queued since the last batch, then wait for the next one
+        while not self.stopped.is_set():
+            batch = []
+            try:
+                batch.append(self.records.get(timeout=1.0))
+                while True:
+                    batch.append(self.records.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                self.write(batch)
+            self.stopped.wait(self.flush_interval)
+
+    def write(self, batch):
+        text = '\n'.join(batch) + '\n'
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        if self.file:
+            self.file.write(text)
+            self.file.flush()
+            if self.file.tell() >= self.max_bytes:
+                self.rotate()
+        if self.ui_lines is not None:
+            self.ui_lines.extend(batch)
+
+    def rotate(self):
+        # Shift LOG_FILE.N to LOG_FILE.N+1, dropping the oldest, and start a new file
+        self.file.close()
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists('%s.%d' % (self.path, n)):
+                os.replace('%s.%d' % (self.path, n), '%s.%d' % (self.path, n + 1))
+        if self.backups:
+            os.replace(self.path, self.path + '.1')
+        self.file = open(self.path, 'w')
+
+    def close(self):
+        # Stop the consumer and write what is still queued
+        self.stopped.set()
+        self.thread.join()
+        batch = []
+        try:
+            while True:
+                batch.append(self.records.get_nowait())
+        except queue.Empty:
+            pass
+        if batch:
+            self.write(batch)
+        if self.file:
+            self.file.close()
+
+def log(message):
+    # Log a server message through the request log pipeline once it is set, so it
+    # reaches the log file and the Tk window, else print it
+    if SensorHTTPServer.log_pipeline:
+        SensorHTTPServer.log_pipeline.log(message)
+    else:
+        print(message)
+
+class SamplerService:
+    # Sampler-process end of the pipes of the HTTP worker processes. Runs what the
+    # workers cannot read from shared memory: sensor refreshes, LED outputs, the
+    # sampler metrics and the GPIO events. Each pipe is served by its own thread.
+    def serve(self, connection):
+        thread = Thread(target=self.run, args=(connection,))
+        thread.daemon = True
+        thread.start()
+
+    def run(self, connection):
+        # Answer (name, args) requests with (True, result) or (False, exception)
+        while True:
+            try:
+                name, args = connection.recv()
+            except (EOFError, OSError):
+                return  # The worker exited
+            try:
+                reply = (True, getattr(self, 'call_' + name)(*args))
+            except Exception as e:
+                reply = (False, e)
+            connection.send(reply)
+
+    def call_refresh(self, channels, max_age, wait):
+        return SensorHTTPServer.sampler.refresh(channels, max_age, wait)
+
+    def call_metrics(self):
+        lines = SensorHTTPServer.sampler.metrics() if SensorHTTPServer.sampler else []
+        if SensorHTTPServer.uplink:
+            lines += SensorHTTPServer.uplink.metrics()  # The workers have no Uplink of their own
+        return lines
+
+    def call_output(self, pin, value):
+        GPIO.output(pin, value)
+
+    def call_gpio_version(self):
+        return SensorHTTPServer.gpio_monitor.version()
+
+    def call_gpio_counts(self):
+        return SensorHTTPServer.gpio_monitor.counts()
+
+    def call_gpio_events(self, since, limit):
+        return SensorHTTPServer.gpio_monitor.to_json(since, limit)
+
+    def call_stats_seq(self):
+        return SensorHTTPServer.stats.seq
+
+    def call_stats(self, names):
+        return SensorHTTPServer.stats.to_dict(names)
+
+class SamplerClient:
+    # Stand-in for the SensorSampler in an HTTP worker process. Snapshots come from
+    # the newest samples of the SharedHistoryBuffer, everything else is asked from
+    # the SamplerService over a pool of pipes, one request per pipe at a time.
+    def __init__(self, history, connections, poll_interval=WORKER_POLL_INTERVAL):
+        self.history = history
+        self.connections = queue.Queue()
+        for connection in connections:
+            self.connections.put(connection)
+        self.poll_interval = poll_interval  # Seconds between checks for new samples
+        self.parent = os.getppid()  # The sampler process
+        self.listeners = []
+        self.cached = None  # Snapshot of the newest sample read
+
+    def call(self, name, *args):
+        # Run SamplerService.call_<name>(*args) in the sampler process
+        connection = self.connections.get()
+        try:
+            connection.send((name, args))
+            ok, result = connection.recv()
+        finally:
+            self.connections.put(connection)
+        if not ok:
+            raise result
+        return result
+
+    def add_listener(self, listener):
+        # Register a callable that receives every new snapshot, see start()
+        self.listeners.append(listener)
+
+    def start(self):
+        # Pass the samples the sampler process appends to the listeners
+        thread = Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        seq = self.history.last_seq
+        while True:
+            time.sleep(self.poll_interval)
+            if os.getppid() != self.parent:
+                os._exit(0)  # The sampler process is gone
+            if self.history.last_seq == seq:
+                continue
+            snapshots = self.history.snapshots(seq)
+            for snapshot in snapshots:
+                for listener in self.listeners:
+                    listener(snapshot)
+            seq = snapshots[-1].seq if snapshots else seq
+
+    def latest(self, timeout=None):
+        # Snapshot of the newest sample, None before the first one
+        cached = self.cached
+        if cached is None or cached.seq != self.history.last_seq:
+            snapshots = self.history.snapshots()
+            cached = self.cached = snapshots[-1] if snapshots else None
+        return cached
+
+    def is_ready(self, channels):
+        # See SensorSampler.is_ready(), the channels are known measured once their values are set
+        snapshot = self.latest()
+        if snapshot is None:
+            return False
+        values = {'dps': snapshot.temperature, 'co2': snapshot.co2}
+        return not channels or any(values[channel] is not None for channel in channels)
+
+    def refresh(self, channels, max_age, wait=False):
+        return self.call('refresh', channels, max_age, wait)
+
+    def metrics(self):
+        return self.call('metrics')
+
+class RemoteGpio:
+    # GPIO backend of the HTTP worker processes, the LED outputs are set by the sampler process
+    LOW, HIGH = 0, 1
+
+    def __init__(self, client):
+        self.client = client
+
+    def output(self, pin, value):
+        self.client.call('output', pin, value)
+
+class RemoteGpioMonitor:
+    # The GpioMonitor of the sampler process, as seen by the HTTP worker processes
+    def __init__(self, client):
+        self.client = client
+
+    def version(self):
+        return self.client.call('gpio_version')
+
+    def counts(self):
+        return self.client.call('gpio_counts')
+
+    def to_json(self, since=None, limit=None):
+        return self.client.call('gpio_events', since, limit)
+
+class RemoteStats:
+    # The RollingStats of the sampler process, as seen by the HTTP worker processes.
+    # The shared history does not tell which channels each sample measured.
+    def __init__(self, client, windows=STATS_WINDOWS):
+        self.client = client
+        self.windows = dict(windows)
+
+    @property
+    def seq(self):
+        return self.client.call('stats_seq')
+
+    def to_dict(self, names):
+        return self.client.call('stats', names)
+
 class SensorHTTPServer(BaseHTTPRequestHandler):
-    dps = DPS()  # Initialize the DPS sensor
-    co2_sensor = PA_CO2()  # Initialize the CO2 sensor
+    protocol_version = 'HTTP/1.1'  # Keep the connection open for the next request
+    timeout = HTTP_KEEPALIVE_TIMEOUT  # Socket timeout, frees the thread of an idle or dead client
+    keep_alive = True  # False on the single-threaded server, where one kept-alive client blocks the rest
+    sampler = None  # Class variable to hold the SensorSampler owning the sensors
     web_ui = None  # Class variable to hold reference to WebUI instance
-    historical_data = {
-        'temperature': [],
-        'pressure': [],
-        'co2': [],
-        'date_time': [],
-        'gpio35': [],
-        'gpio36': [],
-        'gpio27': [],
-        'gpio29': [],
-        'gpio31': [],
-        'gpio33': []
-    }
+    history = None  # Class variable to hold the HistoryBuffer of all samples
+    sample_log = None  # Class variable to hold the on-disk SampleLog, if enabled
+    rollups = None  # Class variable to hold the Rollups for downsampled history
+    broadcaster = None  # Class variable to hold the Broadcaster feeding ?q=stream
+    pressure_trace = None  # Class variable to hold the PressureTrace of background mode
+    gpio_monitor = None  # Class variable to hold the GpioMonitor of the input pins
+    log_pipeline = None  # Class variable to hold the LogPipeline of the request log
+    stats = None  # Class variable to hold the RollingStats served by ?q=stats
+    uplink = None  # Class variable to hold the Uplink pushing the samples to a collector
+    startup_error = None  # Class variable to hold why the sensors failed to start
+    # Sampler channels behind the fields of comma-separated queries (?q=temperature,co2)
+    FIELD_CHANNELS = {'temperature': ['dps'], 'pressure': ['dps'], 'co2': ['co2'],
+                      'gpio35': ['dps'], 'gpio36': ['dps'], 'gpio27': ['dps'], 'gpio29': ['dps'],
+                      'gpio31': [], 'gpio33': []}
+    response_cache = ResponseCache()  # Serialized responses shared by all requests
+    # Status lines with the Server header and the fixed response parts, built once
+    STATUS_LINES = {code: ('HTTP/1.1 %d %s\r\nServer: %s %s\r\n' % (
+                               code, BaseHTTPRequestHandler.responses[code][0],
+                               BaseHTTPRequestHandler.server_version, BaseHTTPRequestHandler.sys_version)).encode('latin-1')
+                    for code in (200, 304, 400, 503)}
+    INDEX_PAGE = b"""
+                <html>
+                <head><title>Sensor Data Service</title></head>
+                <body>
+                    <h1>Sensor Data Service</h1>
+                    <p>Use the following queries to get data:</p>
+                    <ul>
+                        <li><a href="/?q=all">All data</a></li>
+                        <li><a href="/?q=temperature">Temperature data</a></li>
+                        <li><a href="/?q=pressure">Pressure data</a></li>
+                        <li><a href="/?q=co2">CO2 data</a></li>
+                        <li><a href="/?q=distance">Distance data</a></li>
+                        <li><a href="/?q=temperature,pressure">Temperature and pressure</a></li>
+                        <li><a href="/?q=all&gpio31=1&gpio33=1">led0 off, led1 off</a></li>
+                        <li><a href="/?q=all&gpio31=0&gpio33=0">led0 on, led1 on</a></li>
+                        <li><a href="/?q=history">History data</a></li>
+                        <li><a href="/?q=stream">Live data stream</a></li>
+                        <li><a href="/?q=gpio_events">GPIO events</a></li>
+                        <li><a href="/?q=stats">Rolling statistics</a></li>
+                        <li><a href="/?q=metrics">Server metrics</a></li>
+                        <li><a href="/?q=dashboard">Dashboard</a></li>
+                        <li><a href="/?q=dashboard_file">Dashboard (dashboard.html)</a></li>
+                    </ul>
+                </body>
+                </html>
+            """
+    INDEX_HEADERS = b'Content-Type: text/html\r\nContent-Length: %d\r\n\r\n' % len(INDEX_PAGE)
+    date_cache = [0, b'']  # Second and Date header line of the last response
     
     @classmethod
     def set_web_ui(cls, ui_instance):
         # Set the WebUI instance
         cls.web_ui = ui_instance
 
-    def _set_headers(self):
-        # Set HTTP headers
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
+    @classmethod
+    def set_sampler(cls, sampler):
+        # Set the SensorSampler the handlers read from
+        cls.sampler = sampler
+
+    @classmethod
+    def set_pressure_trace(cls, pressure_trace):
+        # Set the PressureTrace served by ?q=pressure_trace
+        cls.pressure_trace = pressure_trace
+
+    @classmethod
+    def set_log_pipeline(cls, log_pipeline):
+        # Set the LogPipeline that log_message() queues the request log on
+        cls.log_pipeline = log_pipeline
+
+    @classmethod
+    def set_gpio_monitor(cls, gpio_monitor):
+        # Set the GpioMonitor served by ?q=gpio_events
+        cls.gpio_monitor = gpio_monitor
+
+    @classmethod
+    def set_stats(cls, stats):
+        # Set the RollingStats served by ?q=stats
+        cls.stats = stats
 
-    def do_GET(self): 
+    @classmethod
+    def set_uplink(cls, uplink):
+        # Set the Uplink reported by ?q=metrics
+        cls.uplink = uplink
 
+    @classmethod
+    def set_broadcaster(cls, broadcaster):
+        # Set the Broadcaster that ?q=stream clients subscribe to
+        cls.broadcaster = broadcaster
+
+    @classmethod
+    def set_history(cls, history, sample_log=None, rollups=None):
+        # Set the HistoryBuffer served by ?q=history, the SampleLog for from/to
+        # queries and the Rollups for points=N queries
+        cls.history = history
+        cls.sample_log = sample_log
+        cls.rollups = rollups
+
+    def do_GET(self):
+        # Serve the request and record its duration per query, except for endless streams
+        start = time.perf_counter()
         parsed_path = urlparse(self.path)
         query_params = parse_qs(parsed_path.query)
+        query = query_params.get('q', [None])[0]
+        try:
+            self.handle_query(query, query_params)
+        finally:
+            if query != 'stream':
+                key = 'fields' if query and ',' in query else query
+                histogram = self.request_seconds.get(key) or self.request_seconds[None]
+                histogram.observe(time.perf_counter() - start)
+
+    def handle_query(self, query, query_params):
         # Handle GPIO settings
         if 'gpio31' in query_params:
             if query_params['gpio31'][0] == '0':
@@ -301,230 +2361,345 @@ class SensorHTTPServer(BaseHTTPRequestHandler):
             elif query_params['gpio33'][0] == '1':
                 GPIO.output(33, GPIO.HIGH)
 
-        # Handle data queries
-        query = query_params.get('q', [None])[0]
-        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-
-        if query == 'all':
-            data = self.handle_all()
-        elif query == 'temperature':
-            temperature = self.dps.read_temperature()
-            data = {'temperature': temperature, 'date_time': current_time}
-        elif query == 'pressure':
-            pressure = self.dps.read_pressure()
-            data = {'pressure': pressure, 'date_time': current_time}
-        elif query == 'co2':
-            co2_ppm = self.co2_sensor.measure_co2()
-            data = {'co2': co2_ppm, 'date_time': current_time}
-        elif query == 'distance':
-            data = self.handle_distance()
-        elif query == 'dashboard':
-            self.handle_dashboard()
-            return
-        elif query == 'history':
-            data = self.handle_history()
+        fields = query.split(',') if query and ',' in query else None
+        if fields and not all(field in self.FIELD_CHANNELS for field in fields):
+            fields = None  # Unknown field, answered with the query list below
+        if fields:
+            channels = sorted(set(channel for field in fields for channel in self.FIELD_CHANNELS[field]))
         else:
-            self.send_response(400)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(b"""
-                <html>
-                <head><title>Sensor Data Service</title></head>
-                <body>
-                    <h1>Sensor Data Service</h1>
-                    <p>Use the following queries to get data:</p>
-                    <ul>
-                        <li><a href="/?q=all">All data</a></li>
-                        <li><a href="/?q=temperature">Temperature data</a></li>
-                        <li><a href="/?q=pressure">Pressure data</a></li>
-                        <li><a href="/?q=co2">CO2 data</a></li>
-                        <li><a href="/?q=distance">Distance data</a></li>
-                        <li><a href="/?q=all&gpio31=1&gpio33=1">led0 off, led1 off</a></li>
-                        <li><a href="/?q=all&gpio31=0&gpio33=0">led0 on, led1 on</a></li>
-                        <li><a href="/?q=history">History data</a></li>
-                        <li><a href="/?q=dashboard">Dashboard</a></li>
-                    </ul>
-                </body>
-                </html>
-            """)
+            channels = self.SENSOR_QUERIES.get(query)
+        if channels is not None and (self.sampler is None or not self.sampler.is_ready(channels)):
+            self.send_starting()
             return
 
-        self._set_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
-        
-    def do_GET2(self):
-        # Handle GET requests
-        query = self.path.split('=')[-1] if '=' in self.path else None        
-        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        if query == 'all':
-            data = self.handle_all()
-        elif query == 'temperature':
-            temperature = self.dps.read_temperature()
-            data = {'temperature': temperature, 'date_time': current_time}
-        elif query == 'pressure':
-            pressure = self.dps.read_pressure()
-            data = {'pressure': pressure, 'date_time': current_time}
-        elif query == 'co2':
-            co2_ppm = self.co2_sensor.measure_co2()
-            data = {'co2': co2_ppm, 'date_time': current_time}
-        elif query == 'distance':
-            data = self.handle_distance()
-        elif query == 'dashboard':
-            self.handle_dashboard()
+        # Handle data queries through the route tables
+        if fields:
+            build = lambda: self.handle_fields(fields)
+        elif query in self.DATA_ROUTES:
+            handler, channels = self.DATA_ROUTES[query]
+            build = lambda: handler(self)
+        elif query in self.ROUTES:
+            self.ROUTES[query](self, query_params)
             return
-        elif query == 'history':
-            data = self.handle_history()
         else:
-            self.send_response(400)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            # Inside the relevant handler or function that generates the HTML response
-            self.wfile.write(b"""
-                <html>
-                <head><title>Sensor Data Service</title></head>
-                <body>
-                    <h1>Sensor Data Service</h1>
-                    <p>Use the following queries to get data:</p>
-                    <ul>
-                        <li><a href="/?q=all">All data</a></li>
-                        <li><a href="/?q=temperature">Temperature data</a></li>
-                        <li><a href="/?q=pressure">Pressure data</a></li>
-                        <li><a href="/?q=co2">CO2 data</a></li>
-                        <li><a href="/?q=distance">Distance data</a></li>
-                        <li><a href="/?q=history">History data</a></li>
-                        <li><a href="/?q=dashboard">Dashboard</a></li>
-                    </ul>
-                </body>
-                </html>
-            """)
+            self.send_fast(400, self.INDEX_HEADERS, self.INDEX_PAGE)
+            return
 
+        max_age = query_params.get('max_age', [None])[0]
+        if max_age is not None:
+            # Refresh values older than max_age, the response carries the age of the data
+            try:
+                max_age = float(max_age)
+            except ValueError:
+                self.send_error(400, "Invalid max_age")
+                return
+            wait = query_params.get('wait', ['0'])[0] == '1'
+            age = self.sampler.refresh(channels, max_age, wait) if channels else 0.0
+            data = build()
+            data['age'] = round(age, 3)
+            self.send_cached(json_response(data))
             return
-        
-        self._set_headers()
-        self.wfile.write(json.dumps(data).encode('utf-8'))
-
-    def _set_headers(self):
-        # Set HTTP headers for HTML responses
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
-        self.end_headers()
-
-    def handle_file(self):
-        # Handle requests for the dashboard HTML page
-        self._set_headers()
+
+        # Serialize once per new sample, shared by every request until the next one
+        version = self.sampler.latest().seq
+        self.send_cached(self.response_cache.get(query, version, lambda: json_response(build())))
+
+    def send_starting(self):
+        # Answer 503 until the sensors are up, with the reason if they failed to start
+        body = (self.startup_error or "Sensors are starting").encode('utf-8')
+        self.send_fast(503, b'Content-Type: text/plain\r\nRetry-After: 1\r\nContent-Length: %d\r\n\r\n'
+                       % len(body), body)
+
+    def date_header(self):
+        # Date header line, formatted once per second
+        now = int(time.time())
+        cache = self.date_cache
+        if cache[0] != now:
+            cache[1] = ('Date: %s\r\n' % formatdate(now, usegmt=True)).encode('latin-1')
+            cache[0] = now
+        return cache[1]
+
+    def send_fast(self, code, headers, body=b''):
+        # Send a response with a prebuilt header block in a single write, headers
+        # ends with the blank line and must hold the Content-Length of a body
+        self.log_request(code, len(body) if body else '-')
+        if self.keep_alive:
+            self.wfile.write(b''.join((self.STATUS_LINES[code], self.date_header(), headers, body)))
+            return
+        self.close_connection = True
+        self.wfile.write(b''.join((self.STATUS_LINES[code], self.date_header(), b'Connection: close\r\n',
+                                   headers, body)))
+
+    def end_headers(self):
+        # Close the connection after each response when keep-alive is off
+        if not self.keep_alive and not self.close_connection:
+            self.send_header('Connection', 'close')
+        BaseHTTPRequestHandler.end_headers(self)
+
+    def send_cached(self, response):
+        # Send a cached response, answering If-None-Match with 304 and
+        # sending the gzip copy to clients that accept it
+        compress = len(response.body) >= GZIP_MIN_SIZE and 'gzip' in self.headers.get('Accept-Encoding', '')
+        if response.etag_for(compress) in self.headers.get('If-None-Match', ''):
+            self.send_fast(304, response.headers(304, compress))
+            return
+        body = response.gzipped() if compress else response.body
+        self.send_fast(200, response.headers(200, compress), body)
+
+    def handle_file(self, query_params=None):
+        # Handle requests for the dashboard.html page, read again only when the file changes
         try:
-            with open('dashboard.html', 'rb') as file:
-                self.wfile.write(file.read())
+            modified = os.stat('dashboard.html').st_mtime
         except FileNotFoundError:
-            self.send_response(404)
-            self.wfile.write(b"404 Not Found: dashboard.html file is missing")
-            
-    def handle_dashboard(self):
+            self.send_error(404, "dashboard.html file is missing")
+            return
+        def build():
+            with open('dashboard.html', 'rb') as file:
+                return CachedResponse(file.read(), 'text/html', modified)
+        self.send_cached(self.response_cache.get('dashboard.html', modified, build))
             
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(dashboard_content.encode('utf-8'))
+    def handle_dashboard(self, query_params=None):
+        # Handle requests for the built-in dashboard, encoded once
+        self.send_cached(self.response_cache.get(
+            'dashboard', None, lambda: CachedResponse(dashboard_content.encode('utf-8'), 'text/html')))
         
     def handle_all(self):
         # Handle requests for all sensor data
-        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        temperature = self.dps.read_temperature()
-        pressure = self.dps.read_pressure()
-        co2_ppm = self.co2_sensor.measure_co2()
-        gpio35 = GPIO.input(PIN35)
-        gpio36 = GPIO.input(PIN36)
-        gpio27 = -1 #GPIO.input(PIN27)
-        gpio29 = GPIO.input(PIN29)
-        
-
+        return snapshot_data(self.sampler.latest())
 
+    def handle_stream(self, query_params=None):
+        # Push every new sample to the client as a Server-Sent Event
+        if not self.broadcaster or not isinstance(self.server, ThreadingMixIn):
+            self.send_error(503, "Streaming needs the threaded server")
+            return
+        events = self.broadcaster.subscribe()
+        try:
+            self.send_response(200)
+            self.send_header('Content-type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Connection', 'close')  # The body ends when the connection does
+            self.end_headers()
+            self.wfile.write(('data: %s\n\n' % json.dumps(self.handle_all())).encode('utf-8'))
+            self.wfile.flush()
+            while True:
+                try:
+                    event = events.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    event = b': keep-alive\n\n'
+                self.wfile.write(event)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, TimeoutError):
+            pass
+        finally:
+            self.broadcaster.unsubscribe(events)
+
+    def handle_history(self, query_params=None):
+        # Handle requests for historical data, from/to ranges are read from the sample log
+        if self.history is None:
+            self.send_starting()
+            return
+        query_params = query_params or {}
+        start = query_params.get('from', [None])[0]
+        end = query_params.get('to', [None])[0]
+        points = query_params.get('points', [None])[0]
+        agg = query_params.get('agg', ['mean'])[0]
+        since = query_params.get('since', [None])[0]
+        limit = query_params.get('limit', [None])[0]
+        try:
+            start = parse_time(start) if start else None
+            end = parse_time(end) if end else None
+            points = int(points) if points else None
+            since = int(since) if since else None
+            limit = max(int(limit), 0) if limit else None
+        except ValueError:
+            self.send_error(400, "Invalid from/to time, points, since or limit")
+            return
+        if points is not None and self.rollups:
+            if points < 1 or agg not in Rollups.AGGREGATES:
+                self.send_error(400, "points must be positive and agg one of " + '|'.join(Rollups.AGGREGATES))
+                return
+            points = min(points, ROLLUP_MAX_POINTS)
+            key = ('history', start, end, points, agg)
+            self.send_cached(self.response_cache.get(
+                key, self.history.last_seq, lambda: json_response(self.rollups.query(start, end, points, agg))))
+            return
+        if start is not None or end is not None:
+            if not self.sample_log:
+                self.send_error(404, "from/to need the sample log, HISTORY_LOG is off")
+                return
+            # Streamed from the log, chunked to keep the connection reusable
+            chunked = self.request_version != 'HTTP/1.0'
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Transfer-Encoding' if chunked else 'Connection', 'chunked' if chunked else 'close')
+            self.end_headers()
+            wfile = ChunkedWriter(self.wfile) if chunked else self.wfile
+            self.sample_log.write_json(wfile, start, end, limit)
+            if chunked:
+                wfile.close()
+            return
+        if since is None and limit is None:
+            limit = HISTORY_DEFAULT_LIMIT  # The whole buffer only when asked for
+        key = ('history', since, limit)
+        self.send_cached(self.response_cache.get(
+            key, self.history.last_seq, lambda: CachedResponse(self.history.to_json(since, limit), 'application/json')))
+
+    def handle_pressure_trace(self, query_params):
+        # Handle requests for the high-rate pressure samples, with since / limit like ?q=history
+        if not self.pressure_trace:
+            self.send_error(404, "High-rate pressure sampling is off (FAST_PRESSURE_RATE)")
+            return
+        since = query_params.get('since', [None])[0]
+        limit = query_params.get('limit', [None])[0]
+        try:
+            since = int(since) if since else None
+            limit = max(int(limit), 0) if limit else None
+        except ValueError:
+            self.send_error(400, "Invalid since or limit")
+            return
+        trace = self.pressure_trace
+        self.send_cached(self.response_cache.get(
+            ('pressure_trace', since, limit), trace.last_seq,
+            lambda: CachedResponse(trace.to_json(since, limit), 'application/json')))
+
+    def handle_gpio_events(self, query_params):
+        # Handle requests for the captured GPIO transitions, with since / limit like ?q=history
+        if not self.gpio_monitor:
+            self.send_error(404, "GPIO event capture is off")
+            return
+        since = query_params.get('since', [None])[0]
+        limit = query_params.get('limit', [None])[0]
+        try:
+            since = int(since) if since else None
+            limit = max(int(limit), 0) if limit else None
+        except ValueError:
+            self.send_error(400, "Invalid since or limit")
+            return
+        monitor = self.gpio_monitor
+        self.send_cached(self.response_cache.get(
+            ('gpio_events', since, limit), monitor.version(),
+            lambda: CachedResponse(monitor.to_json(since, limit), 'application/json')))
+
+    def handle_stats(self, query_params):
+        # Handle requests for the rolling statistics, window=1m,15m selects the windows
+        names = query_params.get('window', [None])[0]
+        names = names.split(',') if names else list(self.stats.windows)
+        if not all(name in self.stats.windows for name in names):
+            self.send_error(400, "window must be one of " + '|'.join(self.stats.windows))
+            return
+        stats = self.stats
+        self.send_cached(self.response_cache.get(
+            ('stats', tuple(names)), stats.seq, lambda: json_response(stats.to_dict(names))))
+
+    def handle_metrics(self, query_params=None):
+        # Handle requests for the server metrics in the Prometheus text format.
+        # With HTTP workers the request durations are those of the worker answering.
+        lines = self.sampler.metrics() if self.sampler else []
+        lines.append('# TYPE sensor_http_request_seconds histogram')
+        for query, histogram in self.request_seconds.items():
+            lines += histogram.render('sensor_http_request_seconds', 'query="%s"' % (query or 'other'))
+        if self.history:
+            lines.append('# TYPE sensor_history_samples gauge')
+            lines.append('sensor_history_samples %d' % len(self.history))
+            lines.append('# TYPE sensor_history_capacity gauge')
+            lines.append('sensor_history_capacity %d' % self.history.capacity)
+        if self.sample_log:
+            lines.append('# TYPE sensor_sample_log_records gauge')
+            lines.append('sensor_sample_log_records %d' % self.sample_log.state()[0])  # Read again in workers
+        if self.pressure_trace:
+            lines.append('# TYPE sensor_pressure_trace_samples gauge')
+            lines.append('sensor_pressure_trace_samples %d' % len(self.pressure_trace))
+        if self.gpio_monitor:
+            lines.append('# TYPE sensor_gpio_edges_total counter')
+            for pin, counts in self.gpio_monitor.counts().items():
+                for edge in ('rising', 'falling'):
+                    lines.append('sensor_gpio_edges_total{pin="%s",edge="%s"} %d' % (pin, edge, counts[edge]))
+            lines.append('# TYPE sensor_gpio_bounces_total counter')
+            for pin, counts in self.gpio_monitor.counts().items():
+                lines.append('sensor_gpio_bounces_total{pin="%s"} %d' % (pin, counts['bounces']))
+        if self.uplink:
+            lines += self.uplink.metrics()
+        if self.log_pipeline:
+            lines.append('# TYPE sensor_log_dropped_total counter')
+            lines.append('sensor_log_dropped_total %d' % self.log_pipeline.dropped)
+        if self.broadcaster:
+            lines.append('# TYPE sensor_stream_clients gauge')
+            lines.append('sensor_stream_clients %d' % len(self.broadcaster.subscribers))
+            lines.append('# TYPE sensor_stream_dropped_events_total counter')
+            lines.append('sensor_stream_dropped_events_total %d' % self.broadcaster.dropped)
+        body = ('\n'.join(lines) + '\n').encode('utf-8')
+        self.send_cached(CachedResponse(body, 'text/plain; version=0.0.4; charset=utf-8'))
+
+    def handle_fields(self, fields):
+        # Handle comma-separated queries with just the requested fields of the latest sample
+        snapshot = self.sampler.latest()
+        data = {field: getattr(snapshot, field) for field in fields}
+        data['date_time'] = snapshot.date_time
+        data['seq'] = snapshot.seq
+        return data
 
+    def handle_temperature(self):
+        # Handle requests for temperature data
+        snapshot = self.sampler.latest()
+        return {'temperature': snapshot.temperature, 'date_time': snapshot.date_time}
 
- 
-        data = {
-                'temperature': temperature,
-                'pressure': pressure,
-                'co2': co2_ppm,
-                'gpio35': gpio35,
-                'gpio36': gpio36,
-                'gpio27': gpio27,
-                'gpio29': gpio29,
-                'gpio31': gpio31,
-                'gpio33': gpio33,
-                'date_time': current_time
-        }
-            
-        # Update historical data
-        self.historical_data['temperature'].append(temperature)
-        self.historical_data['pressure'].append(pressure)
-        self.historical_data['co2'].append(co2_ppm)
-        self.historical_data['gpio35'].append(gpio35)
-        self.historical_data['gpio36'].append(gpio36)
-        self.historical_data['gpio27'].append(gpio27)
-        self.historical_data['gpio29'].append(gpio29)
-        self.historical_data['gpio31'].append(gpio31)
-        self.historical_data['gpio33'].append(gpio33)
-        self.historical_data['date_time'].append(current_time)
-
-        # Ensure only the last 50 records are kept
-        if len(self.historical_data['temperature']) > 50:
-            self.historical_data['temperature'].pop(0)
-            self.historical_data['pressure'].pop(0)
-            self.historical_data['co2'].pop(0)
-            self.historical_data['gpio35'].pop(0)
-            self.historical_data['gpio36'].pop(0)
-            self.historical_data['gpio27'].pop(0)
-            self.historical_data['gpio29'].pop(0)
-            self.historical_data['gpio31'].pop(0)
-            self.historical_data['gpio33'].pop(0)
-            self.historical_data['date_time'].pop(0)
+    def handle_pressure(self):
+        # Handle requests for pressure data
+        snapshot = self.sampler.latest()
+        return {'pressure': snapshot.pressure, 'date_time': snapshot.date_time}
 
-        return data
+    def handle_co2(self):
+        # Handle requests for CO2 data
+        snapshot = self.sampler.latest()
+        return {'co2': snapshot.co2, 'date_time': snapshot.date_time}
 
-    def handle_history(self):
-        # Handle requests for historical data
-        historical_data = {
-            'temperature': self.historical_data['temperature'],
-            'pressure': self.historical_data['pressure'],
-            'co2': self.historical_data['co2'],
-            'gpio27': self.historical_data['gpio27'],
-            'gpio29': self.historical_data['gpio29'],
-            'gpio31': self.historical_data['gpio31'],
-            'gpio33' : self.historical_data['gpio33'],
-            'gpio35': self.historical_data['gpio35'],
-            'gpio36': self.historical_data['gpio36'],
-            'date_time': self.historical_data['date_time']
-        }
-        return historical_data
-    
     def handle_distance(self):
         # Handle requests for GPIO pin data
-        gpio35 = GPIO.input(PIN35)  # distance 0
-        gpio36 = GPIO.input(PIN36) # distance 1
-        gpio27 = GPIO.input(PIN27)  # button 0
-        gpio29 = GPIO.input(PIN29) # button 1
+        snapshot = self.sampler.latest()
         data = {
-            'gpio35': gpio35,
-            'gpio36': gpio36,
-            'gpio27': gpio27,
-            'gpio29': gpio29,
-            'date_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            'gpio35': snapshot.gpio35,  # distance 0
+            'gpio36': snapshot.gpio36,  # distance 1
+            'gpio27': snapshot.gpio27,  # button 0
+            'gpio29': snapshot.gpio29,  # button 1
+            'date_time': snapshot.date_time
         }
         return data
 
     def log_message(self, format, *args):
-        # Log HTTP server messages
-        message = f"{self.address_string()} - - [{self.log_date_time_string()}] {format % args}"
-        print(message)
-        if self.web_ui:
-            self.web_ui.update_log(message)
+        # Log HTTP server messages, queued so that writing them never delays the request
+        log(f"{self.address_string()} - - [{self.log_date_time_string()}] {format % args}")
+
+    # Route table of ?q=. Data queries map to a builder of the JSON dict, cached
+    # per sample, and the sampler channels that max_age refreshes; the other
+    # queries map to a handler that writes the whole response.
+    DATA_ROUTES = {'all': (handle_all, ['dps', 'co2']),
+                   'temperature': (handle_temperature, ['dps']),
+                   'pressure': (handle_pressure, ['dps']),
+                   'co2': (handle_co2, ['co2']),
+                   'distance': (handle_distance, ['dps'])}
+    ROUTES = {'dashboard': handle_dashboard,
+              'dashboard_file': handle_file,
+              'history': handle_history,
+              'stream': handle_stream,
+              'pressure_trace': handle_pressure_trace,
+              'gpio_events': handle_gpio_events,
+              'stats': handle_stats,
+              'metrics': handle_metrics}
+    # Queries answered from the sensors and their sampler channels. They answer 503
+    # until start_sensors() has set the sampler and one of the channels has a value,
+    # the others are null until their first sample. The history and the metrics are
+    # served without the sensors, e.g. the sample log of earlier runs.
+    SENSOR_QUERIES = dict({query: channels for query, (handler, channels) in DATA_ROUTES.items()},
+                          stream=['dps', 'co2'], pressure_trace=['dps'], stats=['dps', 'co2'])
+    # Duration of do_GET per query, unknown queries are counted under None
+    request_seconds = {query: Histogram() for query in list(DATA_ROUTES) + list(ROUTES) + ['fields', None]
+                       if query != 'stream'}
 
 class WebUI:
-    def __init__(self, private_ip, public_ip):
+    def __init__(self, private_ip, public_ip=None):
+        from tkinter import Tk
         self.private_ip = private_ip  # Private IP address
-        self.public_ip = public_ip  # Public IP address
+        self.public_ip = public_ip  # Public IP address, None until resolve_public_ip() finishes
 
         self.root = Tk()
         self.root.title("Sensor HTTP Server Info")
@@ -533,11 +2708,15 @@ class WebUI:
 
     def create_widgets(self):
         # Create UI elements
+        from tkinter import Label, Text, Scrollbar, VERTICAL, Button, PhotoImage
+        import qrcode
+        from PIL import Image
         Label(self.root, text=f"Private IP: {self.private_ip}:{PORT}").pack()        
         self.copy_private_ip_button = Button(self.root, text="Copy Private IP", command=self.copy_private_ip)
         self.copy_private_ip_button.pack()
         
-        Label(self.root, text=f"Public IP: {self.public_ip}:{PORT}").pack()
+        self.public_ip_label = Label(self.root, text=f"Public IP: {self.public_ip or 'resolving...'}:{PORT}")
+        self.public_ip_label.pack()
         self.copy_public_ip_button = Button(self.root, text="Copy Public IP", command=self.copy_public_ip)
         self.copy_public_ip_button.pack()
         
@@ -571,17 +2750,50 @@ class WebUI:
         scrollbar.pack(side='right', fill='y')
 
     def update_log(self, message):
-        # Update the log text in the UI
+        # Update the log text in the UI, only call this on the Tk thread
+        from tkinter import END
         self.log_text.insert(END, f"{message}\n")
+        lines = int(self.log_text.index('end-1c').split('.')[0]) - 1
+        if lines > LOG_UI_LINES:
+            self.log_text.delete('1.0', '%d.0' % (lines - LOG_UI_LINES + 1))
         self.log_text.yview(END)
 
+    def attach_log(self, log_pipeline, interval=LOG_FLUSH_INTERVAL):
+        # Show the lines of log_pipeline, taken in batches on the Tk thread every interval seconds
+        log_pipeline.attach_ui()
+        def poll():
+            lines = log_pipeline.take_ui_lines()
+            if lines:
+                self.update_log('\n'.join(lines))
+            self.root.after(int(interval * 1000), poll)
+        poll()
+
+    def resolve_public_ip(self):
+        # Look the public IP address up in the background and show it when it arrives
+        def resolve():
+            try:
+                public_ip = get_public_ip()
+            except Exception as e:
+                log(f"Public IP lookup failed: {e}")
+                public_ip = 'unknown'
+            self.root.after(0, self.set_public_ip, public_ip)
+        thread = Thread(target=resolve)
+        thread.daemon = True
+        thread.start()
+
+    def set_public_ip(self, public_ip):
+        self.public_ip = public_ip
+        self.public_ip_label.config(text=f"Public IP: {public_ip}:{PORT}")
+
     def copy_private_ip(self):
         # Copy private IP address to clipboard
+        import pyperclip
         pyperclip.copy(f"http://{self.private_ip}:{PORT}")
         self.update_log("Private IP copied to clipboard")
 
     def copy_public_ip(self):
         # Copy public IP address to clipboard
+        import pyperclip
         pyperclip.copy(f"http://{self.public_ip}:{PORT}")
         self.update_log("Public IP copied to clipboard")
 
@@ -590,33 +2802,88 @@ class WebUI:
         self.root.mainloop()
 
 def get_private_ip():
-    # Get the private IP address of the machine
+    # Get the private IP address of the machine, no packet is sent
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
         s.connect(("8.8.8.8", 80))
         ip = s.getsockname()[0]
+    except OSError:
+        ip = '127.0.0.1'  # No network route
     finally:
         s.close()
     return ip
 
 def get_public_ip():
     # Get the public IP address of the machine
-    return requests.get('https://api.ipify.org').text
+    import requests
+    return requests.get('https://api.ipify.org', timeout=10).text
 
-def run_server():
-    # Run the HTTP server
+def run_server(threaded=HTTP_THREADED):
+    # Run the HTTP server, one thread per request when threaded
     server_address = ('', PORT)
-    httpd = HTTPServer(server_address, SensorHTTPServer)
-    print(f"Starting HTTP server on {private_ip}:{PORT}")
-    SensorHTTPServer.web_ui.update_log(f"Starting HTTP server on {private_ip}:{PORT}")
+    server_class = ThreadingHTTPServer if threaded else HTTPServer
+    SensorHTTPServer.keep_alive = threaded
+    httpd = server_class(server_address, SensorHTTPServer)
+    log(f"Starting HTTP server on {get_private_ip()}:{PORT}")
     httpd.serve_forever()
 
-if __name__ == "__main__":
-    private_ip = get_private_ip()
-    public_ip = get_public_ip()
+def start_workers(count, stores, pipes=WORKER_PIPES):
+    # Fork count HTTP worker processes accepting on one listening socket, and serve
+    # their pipes to this process. Call before other threads are started.
+    httpd = ThreadingHTTPServer(('', PORT), SensorHTTPServer)
+    httpd.socket.setblocking(False)  # A worker losing the race for a connection goes back to select()
+    context = multiprocessing.get_context('fork')
+    service = SamplerService()
+    workers = []
+    connections = []
+    for n in range(count):
+        ends = [context.Pipe() for _ in range(pipes)]
+        worker = context.Process(target=run_worker, args=(httpd, [end for end, parent_end in ends], stores),
+                                 name='http-worker-%d' % n)
+        worker.daemon = True  # Terminated when the sampler process exits
+        worker.start()
+        workers.append(worker)
+        connections += [parent_end for end, parent_end in ends]
+    httpd.server_close()  # The workers have their own copies of the socket
+    for connection in connections:
+        service.serve(connection)
+    log(f"Started {count} HTTP workers on {get_private_ip()}:{PORT}")
+    return workers
+
+def run_worker(httpd, connections, stores):
+    # Body of an HTTP worker process: serve from the shared sample stores and ask
+    # the sampler process for the rest, see SamplerClient
+    history, rollups, pressure_trace = stores
+    client = SamplerClient(history, connections)
+    set_gpio_backend(RemoteGpio(client))
+    broadcaster = Broadcaster()
+    client.add_listener(broadcaster.publish)
+    client.start()
+    SensorHTTPServer.set_broadcaster(broadcaster)
+    SensorHTTPServer.set_stats(RemoteStats(client))
+    SensorHTTPServer.set_pressure_trace(pressure_trace)
+    SensorHTTPServer.set_history(history, SampleLogReader(HISTORY_LOG) if HISTORY_LOG else None, rollups)
+    if SensorHTTPServer.gpio_monitor:
+        SensorHTTPServer.set_gpio_monitor(RemoteGpioMonitor(client))
+    SensorHTTPServer.set_sampler(client)
+    httpd.serve_forever()
 
-        
-    # Setup GPIO pins
+def create_stores(shared=False):
+    # The in-memory sample stores (history, rollups, pressure trace), in shared
+    # memory when HTTP worker processes read them
+    if shared:
+        history = SharedHistoryBuffer(HISTORY_CAPACITY)
+        rollups = Rollups(history, level_class=SharedRollupLevel)
+        pressure_trace = SharedPressureTrace(PRESSURE_TRACE_CAPACITY) if FAST_PRESSURE_RATE else None
+    else:
+        history = HistoryBuffer(HISTORY_CAPACITY)
+        rollups = Rollups(history)
+        pressure_trace = PressureTrace(PRESSURE_TRACE_CAPACITY) if FAST_PRESSURE_RATE else None
+    return history, rollups, pressure_trace
+
+def setup_gpio():
+    # Configure the GPIO pins and create the capture of the input edges, which
+    # GpioMonitor.start() begins. No threads are started here.
     GPIO.setwarnings(False) 
     GPIO.setmode(GPIO.BOARD)
     GPIO.setup(PIN35, GPIO.IN)
@@ -625,21 +2892,54 @@ if __name__ == "__main__":
     GPIO.setup(PIN29, GPIO.IN)# button 1
     GPIO.setup(PIN31, GPIO.OUT)   # LED 0
     GPIO.setup(PIN33, GPIO.OUT)    # LED 1
-
-
-
-    # Start the Tkinter GUI
-    web_ui = WebUI(private_ip, public_ip)
-    SensorHTTPServer.set_web_ui(web_ui)  # Set the WebUI instance to the HTTP server
-
-    # Start the web server in a separate thread
-    server_thread = Thread(target=run_server)
-    server_thread.daemon = True
-    server_thread.start()
-
-    # Run the Tkinter main loop
-    web_ui.run()
-
+    SensorHTTPServer.set_gpio_monitor(GpioMonitor(GPIO_EVENT_PINS))
+
+def start_sensors(stores=None):
+    # Initialize the sensors and the sample stores, start sampling in the background
+    # and hand everything to the HTTP handlers, which answer 503 until then.
+    # stores are the shared stores of create_stores() when HTTP workers read them.
+    history, rollups, pressure_trace = stores or create_stores()
+    # The workers read the log file, so every record is written through right away
+    sample_log = SampleLog(HISTORY_LOG, buffering=0 if stores else -1) if HISTORY_LOG else None
+    SensorHTTPServer.set_history(history, sample_log, rollups)  # Served even if the sensors fail
+    try:
+        i2c_bus = I2CBus(I2C_BUS)  # One shared, locked bus for all sensors
+        dps = DPS(i2c_bus)
+        if FAST_PRESSURE_RATE:
+            dps.start_background_mode(FAST_PRESSURE_RATE, FAST_PRESSURE_OVERSAMPLING)
+        sampler = SensorSampler(dps, PA_CO2(period=CO2_PERIOD, continuous=True, bus=i2c_bus), trace=pressure_trace)
+    except Exception as e:
+        log(f"Sensor initialization failed: {e}")
+        SensorHTTPServer.startup_error = str(e)
+        return
+    sampler.add_listener(history.append)
+    sampler.add_listener(rollups.append)
+    stats = RollingStats()
+    sampler.add_listener(stats.append, channels=True)
+    if sample_log:
+        sampler.add_listener(sample_log.append)
+    broadcaster = Broadcaster()
+    sampler.add_listener(broadcaster.publish)
+    uplink = Uplink(UPLINK_URL) if UPLINK_URL else None
+    if uplink:
+        uplink.start()
+        sampler.add_listener(uplink.append)
+        SensorHTTPServer.set_uplink(uplink)
+    sampler.start()
+    atexit.register(stop_sensors, sampler, sample_log, uplink)
+    SensorHTTPServer.set_broadcaster(broadcaster)
+    SensorHTTPServer.set_stats(stats)
+    SensorHTTPServer.set_pressure_trace(pressure_trace)
+    SensorHTTPServer.set_sampler(sampler)  # Last, it marks the sensors as ready
+
+def stop_sensors(sampler, sample_log=None, uplink=None):
+    # Stop sampling, then spool the samples the uplink has not sent and close the
+    # sample log, at exit
+    sampler.stop()
+    if uplink:
+        uplink.stop()
+    if sample_log:
+        sample_log.close()
 
 dashboard_content = """
             <!DOCTYPE html>
@@ -653,72 +2953,144 @@ dashboard_content = """
                     google.charts.load('current', {'packages':['corechart']});
                     google.charts.setOnLoadCallback(initDashboard);
 
-                    var temperatureData = [['Time', 'Temperature']];
-                    var pressureData = [['Time', 'Pressure']];
-                    var co2Data = [['Time', 'CO2']];
-                    var gpioData = [['Time', 'GPIO 35', 'GPIO 36']];
+                    var maxPoints = 50; // Points shown per chart
+                    var charts = {};
+                    var cursor = null; // Sequence number of the newest sample received
+                    var pending = []; // Samples received since the last redraw
                     var intervalId;
                     var fetchInterval = 5000; // Default interval of 5 seconds
+                    var source = null; // EventSource of ?q=stream, null while the history is polled
+                    var streamRetry = 1000; // ms until the stream is opened again after it failed
 
                     function initDashboard() {
+                        charts.temperature = createChart('temperature_chart', 'Temperature History', ['Temperature']);
+                        charts.pressure = createChart('pressure_chart', 'Pressure History', ['Pressure']);
+                        charts.co2 = createChart('co2_chart', 'CO2 History', ['CO2']);
+                        charts.gpio = createChart('gpio_chart', 'GPIO Pins History', ['GPIO 35', 'GPIO 36']);
+
                         $('#intervalDropdown').val(fetchInterval);
                         $('#intervalDropdown').change(function() {
                             fetchInterval = $(this).val();
                             clearInterval(intervalId);
-                            intervalId = setInterval(fetchData, fetchInterval);
+                            intervalId = setInterval(tick, fetchInterval);
                         });
 
-                        fetchData();
-                        intervalId = setInterval(fetchData, fetchInterval);
-                    }
-
-                    function fetchData() {
-                        $.getJSON("/?q=all", function(data) {
-                            updateChartData(temperatureData, data.temperature, data.date_time, 'temperature_chart', 'Temperature History', 'latest_temperature');
-                            updateChartData(pressureData, data.pressure, data.date_time, 'pressure_chart', 'Pressure History', 'latest_pressure');
-                            updateChartData(co2Data, data.co2, data.date_time, 'co2_chart', 'CO2 History', 'latest_co2');
-                            updateGPIOData(gpioData, data.gpio35, data.gpio36, data.date_time, 'gpio_chart', 'GPIO Pins History', 'latest_gpio');
+                        // Bootstrap once from the history, then only apply new samples
+                        $.getJSON("/?q=history&limit=" + maxPoints, function(history) {
+                            addHistory(history);
+                            redraw();
+                            if (window.EventSource) {
+                                openStream();
+                            }
+                            intervalId = setInterval(tick, fetchInterval);
                         });
                     }
 
-                    function updateChartData(chartData, newData, currentTime, elementId, title, latestElementId) {
-                        var time = currentTime.split(' ')[1];
-
-                        chartData.push([time, newData]);
-                        if (chartData.length > 51) {
-                            chartData.splice(1, 1); // Remove the oldest data point
-                        }
-
-                        var dataTable = google.visualization.arrayToDataTable(chartData);
-                        var options = {
-                            title: title,
-                            curveType: 'function',
-                            legend: { position: 'bottom' }
+                    function openStream() {
+                        var stream = new EventSource("/?q=stream");
+                        stream.onopen = function() {
+                            streamRetry = 1000;
+                        };
+                        stream.onmessage = function(event) {
+                            addSample(JSON.parse(event.data));
                         };
-                        var chart = new google.visualization.LineChart(document.getElementById(elementId));
-                        chart.draw(dataTable, options);
+                        stream.onerror = function() {
+                            // A non-200 answer (503 while the sensors start, or without the threaded
+                            // server) closes the stream for good: poll the history, retry the stream later
+                            if (stream.readyState == EventSource.CLOSED) {
+                                source = null;
+                                setTimeout(openStream, streamRetry);
+                                streamRetry = Math.min(streamRetry * 2, 60000);
+                            }
+                        };
+                        source = stream;
+                    }
 
-                        document.getElementById(latestElementId).innerText = `Latest Value: ${newData} at ${currentTime}`;
+                    function tick() {
+                        if (source) {
+                            redraw();
+                        } else {
+                            $.getJSON("/?q=history&since=" + cursor, function(history) {
+                                addHistory(history);
+                                redraw();
+                            });
+                        }
                     }
 
-                    function updateGPIOData(chartData, newGpio35, newGpio36, currentTime, elementId, title, latestElementId) {
-                        var time = currentTime.split(' ')[1];
+                    function addHistory(history) {
+                        for (var i = 0; i < history.date_time.length; i++) {
+                            pending.push({
+                                temperature: history.temperature[i],
+                                pressure: history.pressure[i],
+                                co2: history.co2[i],
+                                gpio35: history.gpio35[i],
+                                gpio36: history.gpio36[i],
+                                date_time: history.date_time[i]
+                            });
+                        }
+                        cursor = history.seq;
+                    }
 
-                        chartData.push([time, newGpio35, newGpio36]);
-                        if (chartData.length > 51) {
-                            chartData.splice(1, 1); // Remove the oldest data point
+                    function addSample(sample) {
+                        // A smaller sequence number means the server restarted
+                        if (sample.seq != cursor) {
+                            pending.push(sample);
+                            cursor = sample.seq;
                         }
+                    }
 
-                        var dataTable = google.visualization.arrayToDataTable(chartData);
-                        var options = {
-                            title: title,
-                            curveType: 'function',
-                            legend: { position: 'bottom' }
+                    function createChart(elementId, title, columns) {
+                        var dataTable = new google.visualization.DataTable();
+                        dataTable.addColumn('string', 'Time');
+                        for (var i = 0; i < columns.length; i++) {
+                            dataTable.addColumn('number', columns[i]);
+                        }
+                        return {
+                            dataTable: dataTable,
+                            chart: new google.visualization.LineChart(document.getElementById(elementId)),
+                            options: {
+                                title: title,
+                                curveType: 'function',
+                                legend: { position: 'bottom' }
+                            }
                         };
-                        var chart = new google.visualization.LineChart(document.getElementById(elementId));
-                        chart.draw(dataTable, options);
+                    }
+
+                    function redraw() {
+                        if (pending.length == 0) {
+                            return;
+                        }
+                        var samples = pending.slice(-maxPoints);
+                        pending = [];
+
+                        var temperatureRows = [], pressureRows = [], co2Rows = [], gpioRows = [];
+                        for (var i = 0; i < samples.length; i++) {
+                            var time = samples[i].date_time.split(' ')[1];
+                            temperatureRows.push([time, samples[i].temperature]);
+                            pressureRows.push([time, samples[i].pressure]);
+                            co2Rows.push([time, samples[i].co2]);
+                            gpioRows.push([time, samples[i].gpio35, samples[i].gpio36]);
+                        }
+                        updateChart(charts.temperature, temperatureRows);
+                        updateChart(charts.pressure, pressureRows);
+                        updateChart(charts.co2, co2Rows);
+                        updateChart(charts.gpio, gpioRows);
+
+                        var latest = samples[samples.length - 1];
+                        document.getElementById('latest_temperature').innerText = `Latest Value: ${latest.temperature} at ${latest.date_time}`;
+                        document.getElementById('latest_pressure').innerText = `Latest Value: ${latest.pressure} at ${latest.date_time}`;
+                        document.getElementById('latest_co2').innerText = `Latest Value: ${latest.co2} at ${latest.date_time}`;
+                        document.getElementById('latest_gpio').innerText = `Latest Values: GPIO 35: ${latest.gpio35}, GPIO 36: ${latest.gpio36} at ${latest.date_time}`;
+                    }
 
-                        document.getElementById(latestElementId).innerText = `Latest Values: GPIO 35: ${newGpio35}, GPIO 36: ${newGpio36} at ${currentTime}`;
+                    function updateChart(chart, rows) {
+                        // Append the new rows to the persistent table and drop the oldest ones
+                        chart.dataTable.addRows(rows);
+                        var excess = chart.dataTable.getNumberOfRows() - maxPoints;
+                        if (excess > 0) {
+                            chart.dataTable.removeRows(0, excess);
+                        }
+                        chart.chart.draw(chart.dataTable, chart.options);
                     }
                 </script>
             </head>
@@ -782,3 +3154,62 @@ dashboard_content = """
             </html>
             """
 
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sensor HTTP server for the infineon optimus board")
+    parser.add_argument('--headless', action='store_true',
+                        help="serve without the Tk window, the QR code and the public IP lookup")
+    parser.add_argument('--workers', type=int, default=HTTP_WORKERS,
+                        help="HTTP worker processes reading the samples from shared memory "
+                             "(default %d, 0 serves from this process)" % HTTP_WORKERS)
+    args = parser.parse_args()
+
+    setup_gpio()
+    # Exiting on SIGTERM runs the atexit cleanup: the sample log and the uplink
+    # spool are flushed, the shared memory and the workers are cleaned up
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    workers = []
+    stores = None
+    if args.workers > 0:
+        # Fork the HTTP workers before the other threads start, this process keeps
+        # the sensors and writes the request log of all processes
+        stores = create_stores(shared=True)
+        log_pipeline = LogPipeline(LOG_FILE, records=multiprocessing.get_context('fork').Queue(LOG_QUEUE_SIZE))
+        atexit.register(log_pipeline.close)  # Before the queue is torn down
+        SensorHTTPServer.set_log_pipeline(log_pipeline)
+        workers = start_workers(args.workers, stores)
+    else:
+        log_pipeline = LogPipeline(LOG_FILE)
+        atexit.register(log_pipeline.close)  # After the sample log and the uplink have stopped
+        SensorHTTPServer.set_log_pipeline(log_pipeline)
+    log_pipeline.start()
+    SensorHTTPServer.gpio_monitor.start()  # Starts the RPi.GPIO event thread, so after the fork
+
+    if args.headless:
+        # Serve right away, the data queries answer 503 until the sensors are up
+        if not workers:
+            server_thread = Thread(target=run_server)
+            server_thread.daemon = True
+            server_thread.start()
+            workers = [server_thread]
+        start_sensors(stores)
+        for worker in workers:
+            worker.join()
+    else:
+        # Start the Tkinter GUI, the public IP is filled in when the lookup returns
+        web_ui = WebUI(get_private_ip())
+        SensorHTTPServer.set_web_ui(web_ui)  # Set the WebUI instance to the HTTP server
+        web_ui.resolve_public_ip()
+        web_ui.attach_log(log_pipeline)
+
+        # Start the web server and the sensors in separate threads
+        if not workers:
+            server_thread = Thread(target=run_server)
+            server_thread.daemon = True
+            server_thread.start()
+        sensor_thread = Thread(target=start_sensors, args=(stores,))
+        sensor_thread.daemon = True
+        sensor_thread.start()
+
+        # Run the Tkinter main loop
+        web_ui.run()
@@ -0,0 +1,464 @@
+"""
+Simulated hardware for the infineon optimus board
+
+Register models of the DPS310 pressure sensor and the PAS CO2 sensor behind an
+SMBus compatible bus with a configurable latency per I2C transaction, a
+stand-in for the RPi.GPIO module, a local collector for sever.Uplink and fake
+boards for gateway.py. They let sever.py run and be benchmarked on any machine:
+
+    import sever, simulator
+    sever.set_gpio_backend(simulator.SimulatedGPIO())
+    bus = sever.I2CBus(smbus=simulator.SimulatedBus(latency=0.0002))
+    dps = sever.DPS(bus)
+
+"""
+
+import gzip
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlparse
+
+# Coefficients of a real DPS310, encoded into registers 0x10 - 0x21
+DPS310_COEFFICIENTS = {'c0': 204, 'c1': -261, 'c00': 80469, 'c10': -54769, 'c20': -10440,
+                       'c30': -1092, 'c01': -2579, 'c11': 1382, 'c21': 119}
+DPS310_SCALE_FACTORS = {0: 524288, 1: 1572864, 2: 3670016, 3: 7864320,
+                        4: 253952, 5: 516096, 6: 1040384, 7: 2088960}
+DPS310_FIFO_EMPTY = 0x800000
+
+
+def unsigned(value, length):
+    # Two's complement encoding of value in length bits
+    return value & ((1 << length) - 1)
+
+
+class SimulatedDevice:
+    # Byte registers of one I2C device, subclasses react to reads and writes
+    def __init__(self):
+        self.registers = [0] * 256
+
+    def read(self, register):
+        return self.registers[register]
+
+    def write(self, register, value):
+        self.registers[register] = value
+
+
+class SimulatedDPS310(SimulatedDevice):
+    # DPS310 with the coefficient PROM, command-style result registers and
+    # the FIFO of background mode. Raw results are computed back from the
+    # temperature and pressure set on the model, plus noise.
+    def __init__(self, temperature=21.0, pressure=101325.0, noise=0.0, coefficients=DPS310_COEFFICIENTS):
+        SimulatedDevice.__init__(self)
+        self.temperature = temperature  # Degrees Celsius
+        self.pressure = pressure  # Pa
+        self.noise = noise  # Standard deviation of the pressure noise (Pa)
+        self.coefficients = coefficients
+        self.fifo = []
+        self.fifo_time = None  # Time the FIFO was last filled up to
+        self.encode_coefficients()
+        self.registers[0x0D] = 0x10  # Product ID
+        self.registers[0x28] = 0x80  # Coefficient source: external sensor
+
+    def encode_coefficients(self):
+        c = dict((name, unsigned(value, 20 if name in ('c00', 'c10') else 12 if name in ('c0', 'c1') else 16))
+                 for name, value in self.coefficients.items())
+        r = self.registers
+        r[0x10] = c['c0'] >> 4
+        r[0x11] = ((c['c0'] & 0x0F) << 4) | (c['c1'] >> 8)
+        r[0x12] = c['c1'] & 0xFF
+        r[0x13] = c['c00'] >> 12
+        r[0x14] = (c['c00'] >> 4) & 0xFF
+        r[0x15] = ((c['c00'] & 0x0F) << 4) | (c['c10'] >> 16)
+        r[0x16] = (c['c10'] >> 8) & 0xFF
+        r[0x17] = c['c10'] & 0xFF
+        for name, register in [('c01', 0x18), ('c11', 0x1A), ('c20', 0x1C), ('c21', 0x1E), ('c30', 0x20)]:
+            r[register] = c[name] >> 8
+            r[register + 1] = c[name] & 0xFF
+
+    def scale_factors(self):
+        return (DPS310_SCALE_FACTORS[self.registers[0x07] & 0x0F],
+                DPS310_SCALE_FACTORS[self.registers[0x06] & 0x0F])
+
+    def raw_values(self):
+        # Raw (temperature, pressure) results for the current conditions
+        c = self.coefficients
+        k_t, k_p = self.scale_factors()
+        scaled_t = (self.temperature - c['c0'] * 0.5) / c['c1']
+        target = self.pressure + random.gauss(0, self.noise) if self.noise else self.pressure
+        # Newton iteration on the compensation polynomial
+        scaled_p = 0.0
+        for _ in range(20):
+            value = (c['c00'] + scaled_p * (c['c10'] + scaled_p * (c['c20'] + scaled_p * c['c30']))
+                     + scaled_t * (c['c01'] + scaled_p * (c['c11'] + scaled_p * c['c21'])))
+            slope = (c['c10'] + scaled_p * (2 * c['c20'] + 3 * scaled_p * c['c30'])
+                     + scaled_t * (c['c11'] + 2 * scaled_p * c['c21']))
+            scaled_p -= (value - target) / slope
+        return round(scaled_t * k_t), round(scaled_p * k_p)
+
+    def fifo_enabled(self):
+        return bool(self.registers[0x09] & 0x02) and self.registers[0x08] & 0x07 == 0x07
+
+    def fill_fifo(self):
+        # Add the results measured since the last fill at the configured pressure rate
+        now = time.monotonic()
+        if self.fifo_time is None:
+            self.fifo_time = now
+            return
+        rate = 1 << ((self.registers[0x06] >> 4) & 0x07)
+        count = int((now - self.fifo_time) * rate)
+        self.fifo_time += count / rate
+        for i in range(count):
+            raw_t, raw_p = self.raw_values()
+            if i == 0:
+                self.fifo.append(unsigned(raw_t, 24) & ~1)  # Temperature results have the LSB clear
+            self.fifo.append(unsigned(raw_p, 24) | 1)
+        del self.fifo[32:]  # A full FIFO drops new results
+
+    def read(self, register):
+        if register <= 0x05:
+            if self.fifo_enabled() and register <= 0x02:
+                if register == 0x00:
+                    self.fill_fifo()
+                    self.current = self.fifo.pop(0) if self.fifo else DPS310_FIFO_EMPTY
+                return (self.current >> (8 * (2 - register))) & 0xFF
+            if register in (0x00, 0x03):
+                raw_t, raw_p = self.raw_values()
+                self.current_t, self.current_p = unsigned(raw_t, 24), unsigned(raw_p, 24)
+            value = self.current_p if register <= 0x02 else self.current_t
+            return (value >> (8 * (2 - register % 3))) & 0xFF
+        return self.registers[register]
+
+    def write(self, register, value):
+        if register == 0x0C and value & 0x80:
+            self.fifo = []  # FIFO flush
+            self.fifo_time = None
+            return
+        SimulatedDevice.write(self, register, value)
+
+
+class SimulatedPASCO2(SimulatedDevice):
+    # PAS CO2 with idle, single-shot and continuous modes and the data-ready bit.
+    # measurement_time is the single-shot duration; continuous mode uses the
+    # programmed rate multiplied by time_scale.
+    def __init__(self, ppm=450, noise=0, measurement_time=0.0, time_scale=1.0):
+        SimulatedDevice.__init__(self)
+        self.ppm = ppm
+        self.noise = noise
+        self.measurement_time = measurement_time
+        self.time_scale = time_scale
+        self.ready_time = None  # Time the next result becomes available
+        self.registers[0x00] = 0x42  # Product ID
+        self.registers[0x01] = 0x80  # Sensor ready
+        self.registers[0x02], self.registers[0x03] = 0x00, 0x3C
+
+    def period(self):
+        return ((self.registers[0x02] << 8) | self.registers[0x03]) * self.time_scale
+
+    def update(self):
+        # Latch a result when a measurement has finished
+        if self.ready_time is None or time.monotonic() < self.ready_time:
+            return
+        ppm = self.ppm + (random.randint(-self.noise, self.noise) if self.noise else 0)
+        self.registers[0x05], self.registers[0x06] = ppm >> 8, ppm & 0xFF
+        self.registers[0x07] |= 0x10  # DRDY
+        mode = self.registers[0x04] & 0x03
+        if mode == 0x02:
+            self.ready_time += self.period()
+        else:
+            self.ready_time = None
+            self.registers[0x04] &= ~0x03  # Back to idle after a single shot
+
+    def read(self, register):
+        self.update()
+        value = self.registers[register]
+        if register == 0x06:
+            self.registers[0x07] &= ~0x10  # Reading the result clears DRDY
+        return value
+
+    def write(self, register, value):
+        self.update()
+        SimulatedDevice.write(self, register, value)
+        if register == 0x04:
+            mode = value & 0x03
+            if mode == 0x01:
+                self.ready_time = time.monotonic() + self.measurement_time
+            elif mode == 0x02:
+                self.ready_time = time.monotonic() + self.period()
+            else:
+                self.ready_time = None
+
+
+class SimulatedBus:
+    # smbus2.SMBus stand-in routing transactions to the simulated devices.
+    # Every transaction sleeps latency seconds and is counted per address.
+    def __init__(self, devices=None, latency=0.0):
+        if devices is None:
+            devices = {0x77: SimulatedDPS310(), 0x28: SimulatedPASCO2()}
+        self.devices = devices
+        self.latency = latency
+        self.transactions = dict((address, 0) for address in devices)
+        self.lock = Lock()
+
+    def transaction(self, address):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.transactions[address] = self.transactions.get(address, 0) + 1
+        if address not in self.devices:
+            raise IOError(121, "Remote I/O error")
+        return self.devices[address]
+
+    def total(self, address=None):
+        # Transactions so far, for one address or all of them
+        return self.transactions.get(address, 0) if address is not None else sum(self.transactions.values())
+
+    def read_byte(self, address):
+        return self.transaction(address).read(0)
+
+    def read_byte_data(self, address, register):
+        return self.transaction(address).read(register)
+
+    def write_byte_data(self, address, register, value):
+        self.transaction(address).write(register, value)
+
+    def read_i2c_block_data(self, address, register, length):
+        device = self.transaction(address)
+        return [device.read(register + i) for i in range(length)]
+
+    def write_i2c_block_data(self, address, register, data):
+        device = self.transaction(address)
+        for i, value in enumerate(data):
+            device.write(register + i, value)
+
+    def close(self):
+        pass
+
+
+class SimulatedGPIO:
+    # RPi.GPIO stand-in; set_input() changes an input level and fires the
+    # callbacks registered with add_event_detect()
+    BOARD, BCM = 10, 11
+    IN, OUT = 1, 0
+    LOW, HIGH = 0, 1
+    PUD_OFF, PUD_DOWN, PUD_UP = 20, 21, 22
+    RISING, FALLING, BOTH = 31, 32, 33
+
+    def __init__(self):
+        self.levels = {}
+        self.modes = {}
+        self.events = {}  # pin -> (edge, [callbacks])
+
+    def setwarnings(self, flag):
+        pass
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction, pull_up_down=None, initial=None):
+        self.modes[pin] = direction
+        self.levels.setdefault(pin, initial if initial is not None else self.LOW)
+
+    def input(self, pin):
+        if pin not in self.modes:
+            raise RuntimeError("The GPIO channel has not been set up")
+        return self.levels.get(pin, self.LOW)
+
+    def output(self, pin, value):
+        self.levels[pin] = value
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.events[pin] = (edge, [callback] if callback else [])
+
+    def add_event_callback(self, pin, callback):
+        self.events[pin][1].append(callback)
+
+    def remove_event_detect(self, pin):
+        self.events.pop(pin, None)
+
+    def set_input(self, pin, value):
+        # Change an input level like the outside world would
+        previous = self.levels.get(pin, self.LOW)
+        self.levels[pin] = value
+        if pin in self.events and previous != value:
+            edge, callbacks = self.events[pin]
+            if edge == self.BOTH or edge == (self.RISING if value else self.FALLING):
+                for callback in callbacks:
+                    callback(pin)
+
+    def cleanup(self, pins=None):
+        self.events = {}
+
+
+class SimulatedCollector:
+    # Stand-in for the central collector that sever.Uplink POSTs to: a local HTTP
+    # server storing the decoded batches. Every POST is answered with status;
+    # stop() takes the collector off the network, dropping kept-alive
+    # connections, and start() brings it back on the same port.
+    def __init__(self, status=200, latency=0.0):
+        self.status = status
+        self.latency = latency  # Seconds before each answer
+        self.batches = []  # Decoded batches in arrival order
+        self.connections = 0  # TCP connections accepted
+        self.up = False
+        self.port = 0
+        self.server = None
+        self.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/ingest' % self.port
+
+    def samples(self, field='seq'):
+        # One field of all received samples, in arrival order
+        return [value for batch in self.batches for value in batch[field]]
+
+    def start(self):
+        collector = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                collector.connections += 1
+                BaseHTTPRequestHandler.setup(self)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if not collector.up:
+                    self.close_connection = True  # Gone, no answer
+                    return
+                if collector.latency:
+                    time.sleep(collector.latency)
+                if 200 <= collector.status < 300:
+                    if self.headers.get('Content-Encoding') == 'gzip':
+                        body = gzip.decompress(body)
+                    collector.batches.append(json.loads(body))
+                self.send_response(collector.status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        self.port = self.server.server_address[1]
+        self.up = True
+        thread = Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.up = False
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SimulatedBoard:
+    # Stand-in for a board running sever.py, for gateway.py: a local HTTP server
+    # answering ?q=history with since/limit like HistoryBuffer.to_json(). Samples
+    # are made up at rate per second from the time the board was created, and
+    # every answer waits latency seconds (a slow sensor read, a slow link).
+    # stop() takes the board off the network and start() brings it back. A legacy
+    # board answers like sever.py before the sequence numbers: ?q=history without
+    # seq, since or limit, and ?q=all.
+    def __init__(self, latency=0.0, rate=1.0, capacity=3600, status=200, legacy=False):
+        self.latency = latency
+        self.rate = rate
+        self.capacity = capacity
+        self.status = status
+        self.legacy = legacy
+        self.start_time = time.time()
+        self.requests = 0  # Requests answered
+        self.connections = 0  # TCP connections accepted
+        self.up = False
+        self.port = 0
+        self.server = None
+        self.start()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.port
+
+    def last_seq(self):
+        return int((time.time() - self.start_time) * self.rate) + 1
+
+    def history(self, since=None, limit=None):
+        # The ?q=history answer of the board, computed from the sequence numbers
+        last = self.last_seq()
+        count = min(last, self.capacity)
+        if since is not None and since <= last:
+            count = min(count, last - since)
+        if limit is not None:
+            count = min(count, limit)
+        seqs = range(last - count + 1, last + 1)
+        data = {'temperature': [21.0 + 0.01 * (seq % 100) for seq in seqs],
+                'pressure': [101325.0 + seq for seq in seqs],
+                'co2': [400 + seq % 50 for seq in seqs]}
+        for name in ('gpio27', 'gpio29', 'gpio31', 'gpio33', 'gpio35', 'gpio36'):
+            data[name] = [seq % 2 for seq in seqs]
+        data['date_time'] = [time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.start_time + (seq - 1) / self.rate))
+                             for seq in seqs]
+        if not self.legacy:
+            data['seq'] = last
+        return data
+
+    def sample(self):
+        # The ?q=all answer of the board, its newest sample
+        return {name: values[-1] for name, values in self.history(limit=1).items() if name != 'seq'}
+
+    def start(self):
+        board = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                board.connections += 1
+                BaseHTTPRequestHandler.setup(self)
+
+            def do_GET(self):
+                if not board.up:
+                    self.close_connection = True  # Gone, no answer
+                    return
+                if board.latency:
+                    time.sleep(board.latency)
+                query = parse_qs(urlparse(self.path).query)
+                body = b''
+                if board.status == 200 and query.get('q') == ['history']:
+                    since = query.get('since', [None])[0] if not board.legacy else None
+                    limit = query.get('limit', [None])[0] if not board.legacy else None
+                    body = json.dumps(board.history(int(since) if since else None,
+                                                    int(limit) if limit else None)).encode('utf-8')
+                elif board.status == 200 and query.get('q') == ['all']:
+                    body = json.dumps(board.sample()).encode('utf-8')
+                status = board.status if board.status != 200 or body else 400
+                board.requests += 1
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                if len(body) >= 1024 and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = gzip.compress(body)
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The gateway gave up on this board
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        self.port = self.server.server_address[1]
+        self.up = True
+        thread = Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.up = False
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,49 @@
+"""
+DPS.compensate_batch() against the scalar compensation, on simulated hardware
+
+    python -m unittest test_compensation
+
+"""
+
+import random
+import unittest
+
+import simulator
+import sever
+
+
+class CompensateBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.dps = sever.DPS(sever.I2CBus(smbus=simulator.SimulatedBus()))
+        rng = random.Random(12)
+        self.raw_p = [rng.randrange(-(1 << 23), 1 << 23) for _ in range(10000)]
+        self.raw_t = [rng.randrange(-(1 << 23), 1 << 23) for _ in range(10000)]
+
+    def scalar(self):
+        # (temperatures, pressures) of the one-sample path
+        results = [self.dps.compensate(t, p) for p, t in zip(self.raw_p, self.raw_t)]
+        return [t for t, p in results], [p for t, p in results]
+
+    def test_batch_matches_scalar(self):
+        temperatures, pressures = self.dps.compensate_batch(self.raw_p, self.raw_t)
+        expected_t, expected_p = self.scalar()
+        self.assertEqual(len(temperatures), len(expected_t))
+        for value, expected in zip(temperatures, expected_t):
+            self.assertAlmostEqual(float(value), expected, delta=1e-9 * max(1.0, abs(expected)))
+        for value, expected in zip(pressures, expected_p):
+            self.assertAlmostEqual(float(value), expected, delta=1e-9 * max(1.0, abs(expected)))
+
+    def test_without_numpy(self):
+        load_numpy, sever.load_numpy = sever.load_numpy, lambda: None
+        try:
+            self.assertEqual(self.dps.compensate_batch(self.raw_p, self.raw_t), self.scalar())
+        finally:
+            sever.load_numpy = load_numpy
+
+    def test_empty_batch(self):
+        temperatures, pressures = self.dps.compensate_batch([], [])
+        self.assertEqual((len(temperatures), len(pressures)), (0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
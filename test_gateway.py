@@ -0,0 +1,130 @@
+"""
+gateway.py against simulator.SimulatedBoard: a sweep takes as long as the slowest
+board (at most the timeout), not the sum of all boards
+
+    python -m unittest test_gateway
+
+"""
+
+import asyncio
+import json
+import time
+import unittest
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer
+from threading import Thread
+
+import gateway
+import simulator
+
+
+class QuietGatewayHandler(gateway.GatewayHTTPServer):
+    def log_message(self, format, *args):
+        pass
+
+
+def sweep(gw):
+    # One sweep on a new event loop, closing the connections at its end
+    async def once():
+        try:
+            await gw.sweep()
+        finally:
+            gw.close()
+    asyncio.run(once())
+
+
+class GatewayTest(unittest.TestCase):
+    def setUp(self):
+        self.fakes = []
+
+    def tearDown(self):
+        for fake in self.fakes:
+            if fake.up:
+                fake.stop()
+
+    def board(self, board_id, timeout=1.0, **kwargs):
+        fake = simulator.SimulatedBoard(**kwargs)
+        self.fakes.append(fake)
+        return gateway.Board(board_id, fake.url, timeout=timeout)
+
+    def test_sweep_takes_the_slowest_board(self):
+        boards = [self.board('b%d' % n, latency=0.05 * n) for n in range(10)]  # 2.25 s in a row
+        gw = gateway.Gateway(boards)
+        sweep(gw)
+        self.assertLess(gw.last_sweep, 0.45 + 0.4)
+        self.assertEqual(gw.latest(boards)['errors'], {})
+        self.assertEqual(len(gw.latest(boards)['boards']), 10)
+
+    def test_slow_and_dead_boards_do_not_delay_the_sweep(self):
+        boards = [self.board('b%d' % n, latency=0.05) for n in range(5)]
+        boards.append(self.board('slow', timeout=0.5, latency=3.0))
+        dead = self.board('dead', timeout=0.5)
+        self.fakes[-1].stop()
+        boards += [dead, self.board('starting', status=503)]
+        gw = gateway.Gateway(boards)
+        start = time.perf_counter()
+        sweep(gw)
+        self.assertLess(time.perf_counter() - start, 0.5 + 0.4)
+        errors = gw.latest(boards)['errors']
+        self.assertEqual(sorted(errors), ['dead', 'slow', 'starting'])
+        self.assertEqual(errors['starting'], 'HTTP 503')
+        self.assertEqual(sorted(gw.latest(boards)['boards']), ['b0', 'b1', 'b2', 'b3', 'b4'])
+
+    def test_polls_only_new_samples(self):
+        board = self.board('lab', rate=20.0)
+        gw = gateway.Gateway([board])
+        sweep(gw)
+        time.sleep(0.5)
+        sweep(gw)
+        fake = self.fakes[0]
+        self.assertEqual(board.cursor, board.latest.seq)
+        history = json.loads(board.history.to_json())
+        self.assertEqual(history['pressure'], [101325.0 + seq for seq in range(1, board.cursor + 1)])
+        fake.start_time = time.time()  # The board restarts and counts from 1 again
+        sweep(gw)
+        self.assertLessEqual(len(board.history), fake.last_seq())
+
+    def test_board_without_seq_is_polled_for_its_latest_sample(self):
+        board = self.board('old', legacy=True, rate=20.0)
+        gw = gateway.Gateway([board])
+        sweep(gw)
+        time.sleep(0.2)
+        sweep(gw)
+        self.assertTrue(board.legacy)
+        self.assertIsNone(board.error)
+        self.assertEqual(len(board.history), 2)
+        self.assertEqual(board.latest.seq, 2)
+        self.assertGreater(board.latest.pressure, 101325.0)
+
+    def test_merged_responses(self):
+        boards = [self.board('lab'), self.board('hall')]
+        gw = gateway.Gateway(boards, interval=0.2, jitter=0.1)
+        gw.start()
+        QuietGatewayHandler.set_gateway(gw)
+        httpd = ThreadingHTTPServer(('127.0.0.1', 0), QuietGatewayHandler)
+        thread = Thread(target=httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            time.sleep(0.5)
+            connection = HTTPConnection(*httpd.server_address)
+            connection.request('GET', '/?q=all')
+            data = json.loads(connection.getresponse().read())
+            self.assertEqual(sorted(data['boards']), ['hall', 'lab'])
+            connection.request('GET', '/?q=history&board=lab&limit=1')
+            data = json.loads(connection.getresponse().read())
+            self.assertEqual(list(data['boards']), ['lab'])
+            self.assertEqual(len(data['boards']['lab']['pressure']), 1)
+            connection.request('GET', '/?q=all&board=nope')
+            response = connection.getresponse()
+            response.read()
+            self.assertEqual(response.status, 400)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            gw.stop()
+        self.assertEqual([fake.connections for fake in self.fakes], [1, 1])  # Kept alive
+
+
+if __name__ == "__main__":
+    unittest.main()
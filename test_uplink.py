@@ -0,0 +1,127 @@
+"""
+sever.Uplink against simulator.SimulatedCollector: batching, spooling during an
+outage and the ordered redelivery afterwards
+
+    python -m unittest test_uplink
+
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import simulator
+import sever
+
+
+def snapshot(seq):
+    return sever.Snapshot(21.0, 101325.0 + seq, 450, 0, 0, -1, 0, 1, 1, '2024-06-01 00:00:00',
+                          1717200000.0 + seq, seq)
+
+
+def wait_for(condition, timeout=10.0):
+    # Poll condition() until it is true or timeout seconds have passed
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+class UplinkTest(unittest.TestCase):
+    def setUp(self):
+        self.spool = tempfile.mkdtemp()
+        self.collector = simulator.SimulatedCollector()
+        self.uplinks = []
+
+    def tearDown(self):
+        for uplink in self.uplinks:
+            uplink.stop()
+        if self.collector.up:
+            self.collector.stop()
+        shutil.rmtree(self.spool)
+
+    def uplink(self, **kwargs):
+        kwargs = dict({'batch_size': 10, 'max_delay': 0.1, 'spool': self.spool, 'backoff': (0.05, 0.2)}, **kwargs)
+        uplink = sever.Uplink(self.collector.url, **kwargs)
+        uplink.start()
+        self.uplinks.append(uplink)
+        return uplink
+
+    def test_batches_on_one_connection(self):
+        uplink = self.uplink()
+        for seq in range(1, 36):
+            uplink.append(snapshot(seq))
+        self.assertTrue(wait_for(lambda: len(self.collector.samples()) == 35))
+        self.assertEqual(self.collector.samples(), list(range(1, 36)))
+        self.assertTrue(all(len(batch['seq']) <= 10 for batch in self.collector.batches))
+        self.assertEqual(self.collector.connections, 1)
+        self.assertEqual(self.collector.batches[0]['pressure'][0], 101326.0)
+
+    def test_outage_is_replayed_in_order(self):
+        uplink = self.uplink()
+        for seq in range(1, 11):
+            uplink.append(snapshot(seq))
+        self.assertTrue(wait_for(lambda: len(self.collector.samples()) == 10))
+        self.collector.stop()
+        for seq in range(11, 41):
+            uplink.append(snapshot(seq))
+            time.sleep(0.01)
+        self.assertTrue(wait_for(lambda: uplink.spooled and len(os.listdir(self.spool)) >= 2))
+        self.assertGreater(uplink.failed_posts, 0)
+        self.collector.start()
+        for seq in range(41, 51):
+            uplink.append(snapshot(seq))
+        self.assertTrue(wait_for(lambda: len(self.collector.samples()) == 50))
+        self.assertEqual(self.collector.samples(), list(range(1, 51)))  # No gaps, no duplicates
+        self.assertEqual(os.listdir(self.spool), [])
+
+    def test_rejected_batch_is_dropped(self):
+        self.collector.status = 400
+        uplink = self.uplink()
+        uplink.append(snapshot(1))
+        self.assertTrue(wait_for(lambda: uplink.rejected_batches == 1))
+        self.collector.status = 200
+        uplink.append(snapshot(2))
+        self.assertTrue(wait_for(lambda: self.collector.samples() == [2]))
+        self.assertFalse(uplink.spooled)
+
+    def test_server_error_is_retried(self):
+        self.collector.status = 503
+        uplink = self.uplink()
+        uplink.append(snapshot(1))
+        self.assertTrue(wait_for(lambda: uplink.failed_posts > 0))
+        self.collector.status = 200
+        self.assertTrue(wait_for(lambda: self.collector.samples() == [1]))
+
+    def test_spool_is_bounded(self):
+        self.collector.stop()
+        uplink = self.uplink(batch_size=5, max_delay=0.02, spool_max_bytes=1500)
+        for seq in range(1, 101):
+            uplink.append(snapshot(seq))
+            time.sleep(0.002)
+        self.assertTrue(wait_for(lambda: uplink.dropped['spool'] > 0))
+        uplink.stop()
+        self.uplinks.remove(uplink)
+        self.assertLessEqual(uplink.spool_bytes, 1500)
+        self.assertEqual(sum(count for name, count in uplink.spooled) + uplink.dropped['spool'], 100)
+
+    def test_spool_survives_restart(self):
+        self.collector.stop()
+        uplink = self.uplink()
+        for seq in range(1, 26):
+            uplink.append(snapshot(seq))
+        uplink.stop()  # Spools what is still queued
+        self.uplinks.remove(uplink)
+        self.assertEqual(sum(count for name, count in uplink.spooled), 25)
+        open(os.path.join(self.spool, 'README'), 'w').close()  # Not a batch, left alone
+        self.collector.start()
+        self.uplink()
+        self.assertTrue(wait_for(lambda: len(self.collector.samples()) == 25))
+        self.assertEqual(self.collector.samples(), list(range(1, 26)))
+        self.assertEqual(os.listdir(self.spool), ['README'])
+
+
+if __name__ == "__main__":
+    unittest.main()